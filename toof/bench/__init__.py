@@ -0,0 +1,6 @@
+"""Offline benchmarks for the bot. The real extensions are loaded
+against a temporary database and driven with fake Discord objects, so
+nothing here needs a network connection or a token.
+
+Run `python -m toof.bench --help` to see the available benchmarks.
+"""
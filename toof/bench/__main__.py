@@ -0,0 +1,87 @@
+"""Command line entry point for the offline benchmarks."""
+
+import argparse
+import asyncio
+import json
+
+from .harness import run_harness
+from . import pics, replay
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m toof.bench")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    harness = subparsers.add_parser(
+        "harness", help="Drive the cogs with simulated users.")
+    harness.add_argument("--users", type=int, default=1000)
+    harness.add_argument("--ops", type=int, default=1000,
+        help="Operations to run for each workload.")
+    harness.add_argument("--concurrency", type=int, default=50)
+    harness.add_argument("--latency", type=float, default=0.0,
+        help="Seconds each fake API call takes.")
+    harness.add_argument("--workload", action="append", dest="workloads",
+        help="Only run this workload. Can be given more than once.")
+    harness.add_argument("--seed", type=int, default=0)
+    harness.add_argument("--json", action="store_true",
+        help="Print the reports as JSON.")
+
+    replayer = subparsers.add_parser(
+        "replay", help="Replay gateway events recorded with TOOFRECORD.")
+    replayer.add_argument("path", help="The recording to replay.")
+    replayer.add_argument("--speed", type=float, default=0.0,
+        help="1 replays at wall-clock speed, 0 as fast as possible.")
+    replayer.add_argument("--latency", type=float, default=0.0,
+        help="Seconds each stubbed API call takes.")
+    replayer.add_argument("--json", action="store_true",
+        help="Print the report as JSON.")
+
+    pic_bench = subparsers.add_parser(
+        "pics", help="Scale test the ToofPic roll, steal and collection paths.")
+    pic_bench.add_argument("--catalog", type=int, default=500,
+        help="How many pics are in the catalog.")
+    pic_bench.add_argument("--users", type=int, default=5000)
+    pic_bench.add_argument("--density", type=float, default=0.1,
+        help="The fraction of the catalog each user already owns.")
+    pic_bench.add_argument("--ops", type=int, default=2000,
+        help="Operations to run for each workload.")
+    pic_bench.add_argument("--concurrency", type=int, default=50)
+    pic_bench.add_argument("--latency", type=float, default=0.0,
+        help="Seconds each fake API call takes.")
+    pic_bench.add_argument("--seed", type=int, default=0)
+    pic_bench.add_argument("--json", action="store_true",
+        help="Print the report as JSON.")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "harness":
+        reports = asyncio.run(run_harness(
+            users=args.users, ops=args.ops, concurrency=args.concurrency,
+            latency=args.latency, workloads=args.workloads, seed=args.seed))
+        if args.json:
+            print(json.dumps([report.to_dict() for report in reports], indent=2))
+        else:
+            for report in reports:
+                print(report)
+
+    elif args.benchmark == "replay":
+        report = asyncio.run(replay.replay(
+            args.path, speed=args.speed, latency=args.latency))
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(replay.format_report(report))
+
+    elif args.benchmark == "pics":
+        result = asyncio.run(pics.run_pics(
+            catalog=args.catalog, users=args.users, density=args.density,
+            ops=args.ops, concurrency=args.concurrency,
+            latency=args.latency, seed=args.seed))
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print(pics.format_report(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""Stand-ins for the Discord objects the cogs use. They only implement
+what the cogs touch, and every call that would reach the API is
+recorded by a FakeHTTP instead.
+"""
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+import datetime
+from itertools import count
+from typing import Any
+
+import discord
+
+from toof import ToofBot
+from toof.deferral import AutoDeferResponse
+
+
+snowflakes = count(1_000_000_000_000_000)
+
+
+def snowflake() -> int:
+    return next(snowflakes)
+
+
+@dataclass
+class Call:
+    """A single request that would have been sent to Discord."""
+
+    method: str
+    path: str
+    payload: dict[str, Any]
+
+
+class FakeHTTP:
+    """Records the requests the fakes would have made, timing each one
+    under the bot's "http" metrics. Each request can wait `latency`
+    seconds to stand in for the round trip.
+    """
+
+    def __init__(self, bot: "HarnessBot", latency: float = 0.0, keep: bool = False):
+        self.bot = bot
+        self.latency = latency
+        self.keep = keep
+        self.calls: list[Call] = []
+        self.routes: Counter[str] = Counter()
+
+    async def request(self, method: str, path: str, **payload):
+        route = f"{method} {path}"
+        self.routes[route] += 1
+        if self.keep:
+            self.calls.append(Call(method, path, payload))
+        with self.bot.metrics.timer("http", route):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+
+@dataclass
+class FakeAsset:
+    url: str
+
+
+@dataclass(eq=False)
+class FakeRole:
+    id: int
+    name: str
+    guild: "FakeGuild"
+    position: int = 0
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+@dataclass(eq=False)
+class FakeMember:
+    id: int
+    name: str
+    guild: "FakeGuild"
+    roles: list[FakeRole] = field(default_factory=list)
+    bot: bool = False
+    nick: str = None
+    activities: tuple = ()
+
+    @property
+    def http(self) -> FakeHTTP:
+        return self.guild.http
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    @property
+    def display_name(self) -> str:
+        return self.nick or self.name
+
+    @property
+    def avatar(self) -> FakeAsset:
+        return FakeAsset(f"https://cdn.discordapp.com/avatars/{self.id}.png")
+
+    display_avatar = avatar
+
+    async def edit(self, **fields):
+        await self.http.request(
+            "PATCH", "/guilds/{guild_id}/members/{user_id}", **fields)
+        if "roles" in fields:
+            self.roles = [self.guild.default_role, *fields["roles"]]
+        if "nick" in fields:
+            self.nick = fields["nick"]
+
+    async def add_roles(self, *roles, reason: str = None):
+        for role in roles:
+            await self.http.request(
+                "PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason: str = None):
+        for role in roles:
+            await self.http.request(
+                "DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+            if role in self.roles:
+                self.roles.remove(role)
+
+    async def kick(self, reason: str = None):
+        await self.http.request("DELETE", "/guilds/{guild_id}/members/{user_id}")
+        self.guild.member_map.pop(self.id, None)
+
+    async def send(self, content: str = None, **kwargs):
+        await self.http.request("POST", "/users/@me/channels")
+        await self.http.request(
+            "POST", "/channels/{channel_id}/messages", content=content, **kwargs)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+@dataclass(eq=False)
+class FakeChannel:
+    id: int
+    name: str
+    guild: "FakeGuild"
+    category_id: int = None
+    members: list[FakeMember] = field(default_factory=list)
+
+    @property
+    def mention(self) -> str:
+        return f"<#{self.id}>"
+
+    async def send(self, content: str = None, **kwargs) -> "FakeMessage":
+        await self.guild.http.request(
+            "POST", "/channels/{channel_id}/messages", content=content, **kwargs)
+        return FakeMessage(snowflake(), content or "", self.guild.me, self)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+@dataclass(eq=False)
+class FakeMessage:
+    id: int
+    content: str
+    author: FakeMember
+    channel: FakeChannel
+    attachments: list = field(default_factory=list)
+    mentions: list = field(default_factory=list)
+    reference: Any = None
+    edited_at: datetime.datetime = None
+    created_at: datetime.datetime = field(
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    @property
+    def guild(self) -> "FakeGuild":
+        return self.channel.guild
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.guild.id}/{self.channel.id}/{self.id}"
+
+    async def add_reaction(self, emoji):
+        await self.guild.http.request(
+            "PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me")
+
+    async def reply(self, content: str = None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+@dataclass
+class FakeVoiceState:
+    channel: FakeChannel = None
+
+
+class FakeGuild:
+    """A guild with roles, members and channels kept in dicts by id.
+    roles and members are lists, as on discord.Guild.
+    """
+
+    def __init__(self, http: FakeHTTP, id: int = None, name: str = "guild"):
+        self.http = http
+        self.id = id or snowflake()
+        self.name = name
+        self.unavailable = False
+        self.default_role = FakeRole(self.id, "@everyone", self)
+        self.role_map: dict[int, FakeRole] = {self.id: self.default_role}
+        self.member_map: dict[int, FakeMember] = {}
+        self.channels: dict[int, FakeChannel] = {}
+        self.me = self.add_member("Toof", bot=True)
+
+    @property
+    def roles(self) -> list[FakeRole]:
+        return list(self.role_map.values())
+
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self.member_map.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self.member_map)
+
+    @property
+    def voice_channels(self) -> list[FakeChannel]:
+        return [channel for channel in self.channels.values() if channel.category_id]
+
+    def add_role(self, name: str) -> FakeRole:
+        role = FakeRole(snowflake(), name, self, len(self.role_map))
+        self.role_map[role.id] = role
+        return role
+
+    def add_member(self, name: str, bot: bool = False) -> FakeMember:
+        member = FakeMember(snowflake(), name, self, [self.default_role], bot)
+        self.member_map[member.id] = member
+        return member
+
+    def add_channel(self, name: str, category_id: int = None) -> FakeChannel:
+        channel = FakeChannel(snowflake(), name, self, category_id)
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_role(self, id: int) -> FakeRole | None:
+        return self.role_map.get(id)
+
+    def get_member(self, id: int) -> FakeMember | None:
+        return self.member_map.get(id)
+
+    def get_channel(self, id: int) -> FakeChannel | None:
+        return self.channels.get(id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeResponse(discord.InteractionResponse):
+    """Stands in for InteractionResponse, recording each response with
+    the FakeHTTP instead of sending it.
+    """
+
+    def __init__(self, interaction: "FakeInteraction"):
+        super().__init__(interaction)
+
+    @property
+    def interaction(self) -> "FakeInteraction":
+        return self._parent
+
+    async def respond(self, type: str, **kwargs):
+        if self.is_done():
+            raise RuntimeError("This interaction has already been responded to.")
+        # Kept where is_done and the type property look for it.
+        self._response_type = type
+        await self.interaction.http.request(
+            "POST", "/interactions/{interaction_id}/{interaction_token}/callback",
+            type=type, **kwargs)
+
+    async def send_message(self, content: str = None, **kwargs):
+        await self.respond("message", content=content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        await self.respond("update", **kwargs)
+
+    async def defer(self, **kwargs):
+        await self.respond("defer", **kwargs)
+
+    async def send_modal(self, modal):
+        await self.respond("modal", modal=modal)
+
+
+class FakeAutoDeferResponse(AutoDeferResponse, FakeResponse):
+    """An AutoDeferResponse whose underlying responses go to the
+    FakeHTTP, so auto deferral runs for real in the harness.
+    """
+
+
+class FakeFollowup:
+    """Stands in for Interaction.followup."""
+
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content: str = None, **kwargs):
+        await self.interaction.http.request(
+            "POST", "/webhooks/{application_id}/{interaction_token}",
+            content=content, **kwargs)
+
+
+class FakeInteraction:
+    """Stands in for an Interaction from the given member, in the given
+    channel. Slash command interactions carry the `data` payload Discord
+    would send, so they can go through the bot's CommandTree.
+    """
+
+    def __init__(
+            self, bot: "HarnessBot", user: FakeMember, channel: FakeChannel,
+            type: discord.InteractionType = discord.InteractionType.component,
+            data: dict[str, Any] = None):
+        self.id = snowflake()
+        self.client = bot
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.type = type
+        self.data = data or {}
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.extras: dict[str, Any] = {}
+        self.command_failed = False
+        self.followup = FakeFollowup(self)
+        self._state = bot._connection
+        # Filled in by the CommandTree, as on a real Interaction.
+        self._cs_response = FakeResponse(self)
+        self._cs_command = None
+        self._cs_namespace = None
+
+    @property
+    def http(self) -> FakeHTTP:
+        return self.guild.http
+
+    @property
+    def response(self) -> FakeResponse:
+        return self._cs_response
+
+    @property
+    def command(self):
+        if self._cs_command is None and self.type == discord.InteractionType.application_command:
+            self._cs_command, _ = self.client.tree._get_app_command_options(self.data)
+        return self._cs_command
+
+    @property
+    def namespace(self):
+        return self._cs_namespace
+
+    @property
+    def guild_id(self) -> int:
+        return self.guild.id
+
+    @property
+    def channel_id(self) -> int:
+        return self.channel.id
+
+    async def edit_original_response(self, **kwargs):
+        await self.http.request(
+            "PATCH", "/webhooks/{application_id}/{interaction_token}/messages/@original",
+            **kwargs)
+
+
+class HarnessBot(ToofBot):
+    """A ToofBot that never connects. Guilds, channels and users come
+    from the fakes, and API calls go to a FakeHTTP.
+    """
+
+    def __init__(self, dbname: str, latency: float = 0.0):
+        super().__init__(dbname)
+        self.fake_http = FakeHTTP(self, latency)
+        self.defer_response_cls = FakeAutoDeferResponse
+        self.fake_guilds: dict[int, FakeGuild] = {}
+
+    def add_guild(self, name: str = "guild") -> FakeGuild:
+        guild = FakeGuild(self.fake_http, name=name)
+        self.fake_guilds[guild.id] = guild
+        return guild
+
+    @property
+    def guilds(self) -> list[FakeGuild]:
+        return list(self.fake_guilds.values())
+
+    def get_guild(self, id: int) -> FakeGuild | None:
+        return self.fake_guilds.get(id)
+
+    def get_channel(self, id: int) -> FakeChannel | None:
+        for guild in self.fake_guilds.values():
+            if id in guild.channels:
+                return guild.channels[id]
+        return None
+
+    def get_user(self, id: int) -> FakeMember | None:
+        for guild in self.fake_guilds.values():
+            if id in guild.member_map:
+                return guild.member_map[id]
+        return None
+
+    async def fetch_user(self, id: int) -> FakeMember:
+        await self.fake_http.request("GET", "/users/{user_id}")
+        user = self.get_user(id)
+        if user is None:
+            raise discord.NotFound(FakeNotFound(), "Unknown User")
+        return user
+
+    async def is_owner(self, user) -> bool:
+        return True
+
+    async def change_presence(self, **kwargs):
+        await self.fake_http.request("PATCH", "gateway:presence", **kwargs)
+
+
+class FakeNotFound:
+    """Just enough of an aiohttp response to build a discord.NotFound."""
+
+    status = 404
+    reason = "Not Found"
@@ -0,0 +1,353 @@
+"""Loads the real extensions into a HarnessBot with a temporary
+database and a fake guild, then drives the roll, steal, collection,
+role menu, mod log and voice paths with simulated users.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import os
+import random
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+import discord
+from discord.ext import tasks
+
+from toof.cogs.pics import ChangePicButton
+from toof.cogs.roles import RoleAddSelect
+from toof.pics import PicRarity
+
+from .fakes import (
+    FakeChannel, FakeGuild, FakeInteraction, FakeMember, FakeMessage,
+    FakeVoiceState, HarnessBot, snowflake)
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    """Returns the q-th percentile of the sorted latencies."""
+
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+@dataclass
+class Report:
+    """Throughput and latency of one workload."""
+
+    name: str
+    ops: int = 0
+    errors: int = 0
+    # Invocations turned away by a check, like a cooldown.
+    rejected: int = 0
+    elapsed: float = 0.0
+    latencies: list[float] = field(default_factory=list, repr=False)
+    last_error: Exception = None
+
+    @property
+    def throughput(self) -> float:
+        return self.ops / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "name": self.name,
+            "ops": self.ops,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else 0.0,
+            "last_error": repr(self.last_error) if self.last_error else None}
+
+    def __str__(self):
+        return format_row(self.to_dict())
+
+
+def format_row(data: dict) -> str:
+    """Formats a report's dict as one line of a table."""
+
+    return (
+        f"{data['name']:15} {data['ops']:>7} ops {data['errors']:>5} errors "
+        f"{data['rejected']:>5} rejected "
+        f"{data['throughput']:>9.1f} ops/s  p50 {data['p50'] * 1000:>7.2f}ms  "
+        f"p99 {data['p99'] * 1000:>7.2f}ms")
+
+
+def stop_loops(bot: HarnessBot):
+    """Cancels the background loops the cogs start, so only the
+    simulated events do any work.
+    """
+
+    for cog in bot.cogs.values():
+        for name, attr in vars(type(cog)).items():
+            if isinstance(attr, tasks.Loop):
+                getattr(cog, name).cancel()
+
+
+def command_data(tree: discord.app_commands.CommandTree, name: str, **params) -> dict:
+    """Builds the interaction data Discord sends for the slash command
+    with the given qualified name and options. Users are sent as
+    resolved users, the way Discord sends them.
+    """
+
+    parts = name.split()
+    command = tree.get_command(parts[0])
+    for part in parts[1:]:
+        command = command.get_command(part)
+
+    options = []
+    resolved: dict[str, dict] = {}
+    for param in command.parameters:
+        if param.name not in params:
+            continue
+        value = params[param.name]
+        if param.type == discord.AppCommandOptionType.user:
+            resolved.setdefault("users", {})[str(value.id)] = {
+                "id": str(value.id),
+                "username": value.name,
+                "discriminator": "0",
+                "avatar": None}
+            value = str(value.id)
+        options.append({"name": param.name, "type": param.type.value, "value": value})
+
+    # Nests the options under the subcommand, then under any groups.
+    for depth in range(len(parts) - 1, 0, -1):
+        type = 1 if depth == len(parts) - 1 else 2
+        options = [{"name": parts[depth], "type": type, "options": options}]
+    return {
+        "id": str(snowflake()),
+        "name": parts[0],
+        "type": 1,
+        "options": options,
+        "resolved": resolved}
+
+
+async def invoke(bot: HarnessBot, interaction: FakeInteraction):
+    """Sends a slash command interaction through the bot's tree, so it
+    is timed and auto deferred like a real one. Raises the error the
+    command failed with, if any.
+    """
+
+    await bot.tree._call(interaction)
+    error = interaction.extras.get("error")
+    if error is not None:
+        raise error
+
+
+class Harness:
+    """A HarnessBot with one guild full of simulated members, a catalog
+    of ToofPics and a page of self-assignable roles.
+    """
+
+    def __init__(
+            self, users: int = 1000, catalog: int = 100, roles: int = 25,
+            density: float = 0.0, latency: float = 0.0,
+            dbname: str = None, seed: int = 0):
+        self.users = users
+        self.catalog = catalog
+        self.roles = roles
+        self.density = density
+        self.rng = random.Random(seed)
+
+        self.tempdir = None
+        if dbname is None:
+            self.tempdir = tempfile.TemporaryDirectory()
+            dbname = os.path.join(self.tempdir.name, "bench.sqlite")
+        self.dbname = dbname
+        self.bot = HarnessBot(dbname, latency)
+
+        self.guild: FakeGuild = None
+        self.members: list[FakeMember] = []
+        self.channel: FakeChannel = None
+        self.log_channel: FakeChannel = None
+        self.voice_channel: FakeChannel = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        # Binds the client to the running loop, which login would do.
+        await self.bot._async_setup_hook()
+        self.bot.tree.error(self.on_command_error)
+        await self.bot.setup_db()
+        await self.populate()
+        await self.bot.load_cogs(skip={"twitter"})
+        stop_loops(self.bot)
+
+    async def stop(self):
+        for name in list(self.bot.extensions):
+            await self.bot.unload_extension(name)
+        await self.bot.db.close()
+        if self.tempdir is not None:
+            self.tempdir.cleanup()
+
+    async def populate(self):
+        """Fills the guild and the database."""
+
+        bot = self.bot
+        self.guild = bot.add_guild("bench")
+        self.channel = self.guild.add_channel("general")
+        self.log_channel = self.guild.add_channel("log")
+        category = snowflake()
+        self.voice_channel = self.guild.add_channel("voice one", category)
+        self.members = [
+            self.guild.add_member(f"user{i}") for i in range(self.users)]
+
+        await bot.db.execute(
+            "INSERT INTO guilds VALUES (?, ?, 0, 0, 0, 0, 0, 1)",
+            (self.guild.id, self.log_channel.id))
+
+        rarities = PicRarity.list()
+        weights = [rarity.weight for rarity in rarities]
+        pics = [
+            (f"{rarity.name[0].upper()}{i + 1:03d}", f"pic {i + 1}",
+             f"https://example.com/{i + 1}.png", "00:00 01/01/2024")
+            for i, rarity in enumerate(
+                self.rng.choices(rarities, weights, k=self.catalog))]
+        await bot.db.executemany(
+            "INSERT INTO pics VALUES (0, ?, ?, ?, ?)", pics)
+
+        # Each member owns `density` of the catalog.
+        owned = round(self.density * len(pics))
+        if owned:
+            await bot.db.executemany(
+                "INSERT INTO pics VALUES (?, ?, ?, ?, ?)",
+                [(member.id, *pic)
+                 for member in self.members
+                 for pic in self.rng.sample(pics, owned)])
+            await bot.rebuild_ownership()
+
+        await bot.db.executemany(
+            "INSERT INTO roles VALUES (?, ?, ?, ?, ?)",
+            [(self.guild.id, self.guild.add_role(f"role {i}").id,
+              "🔔", f"role number {i}", "pings")
+             for i in range(self.roles)])
+        await bot.db.commit()
+
+    async def on_command_error(
+            self, interaction: FakeInteraction,
+            error: discord.app_commands.AppCommandError):
+        # Kept for invoke to raise, instead of being logged.
+        interaction.extras["error"] = error
+
+    def member(self) -> FakeMember:
+        return self.rng.choice(self.members)
+
+    def interaction(self, member: FakeMember = None) -> FakeInteraction:
+        return FakeInteraction(self.bot, member or self.member(), self.channel)
+
+    async def command(self, name: str, member: FakeMember = None, **params):
+        """Runs the slash command with the given qualified name as a
+        member, through the bot's tree.
+        """
+
+        interaction = FakeInteraction(
+            self.bot, member or self.member(), self.channel,
+            type=discord.InteractionType.application_command,
+            data=command_data(self.bot.tree, name, **params))
+        await invoke(self.bot, interaction)
+
+    async def roll(self, count: int = 1):
+        await self.command("pic roll", count=count)
+
+    async def ten_pull(self):
+        await self.roll(10)
+
+    async def steal(self):
+        await self.command("pic steal", target=self.member())
+
+    async def collection(self):
+        await self.command("pic collection")
+
+    async def collection_page(self):
+        member = self.member()
+        button = ChangePicButton(
+            member.id, "common", self.rng.randrange(self.catalog), "next")
+        await button.callback(self.interaction(member))
+
+    async def roles_menu(self):
+        interaction = self.interaction()
+        role_menu = await self.bot.get_role_menu(self.guild)
+        category = role_menu.categories[0]
+        options = role_menu.options[category.name][0]
+
+        select = RoleAddSelect(category.id, 0, options)
+        select.item._values = [
+            option.value for option in
+            self.rng.sample(options, self.rng.randint(0, len(options)))]
+        await select.callback(interaction)
+
+    async def mod_log(self):
+        message = FakeMessage(
+            snowflake(), "some message that got deleted",
+            self.member(), self.channel)
+        await self.bot.get_cog("ModCog").on_message_delete(message)
+
+    async def voice(self):
+        member = self.member()
+        cog = self.bot.get_cog("VoiceCog")
+        await cog.on_voice_state_update(
+            member, FakeVoiceState(), FakeVoiceState(self.voice_channel))
+        await cog.on_voice_state_update(
+            member, FakeVoiceState(self.voice_channel), FakeVoiceState())
+
+    async def run(
+            self, name: str, work: Callable[[], Awaitable],
+            ops: int, concurrency: int = 50) -> Report:
+        """Runs `work` ops times with at most `concurrency` in flight."""
+
+        report = Report(name)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await work()
+                except discord.app_commands.CheckFailure:
+                    report.rejected += 1
+                except Exception as error:
+                    report.errors += 1
+                    report.last_error = error
+                report.latencies.append(time.perf_counter() - start)
+                report.ops += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(ops)])
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    @property
+    def workloads(self) -> dict[str, Callable[[], Awaitable]]:
+        return {
+            "roll": self.roll,
+            "roll-10": self.ten_pull,
+            "steal": self.steal,
+            "collection": self.collection,
+            "collection-page": self.collection_page,
+            "roles": self.roles_menu,
+            "mod-log": self.mod_log,
+            "voice": self.voice}
+
+
+async def run_harness(
+        users: int = 1000, ops: int = 1000, concurrency: int = 50,
+        latency: float = 0.0, workloads: list[str] = None,
+        seed: int = 0) -> list[Report]:
+    """Runs each workload against a fresh harness and returns their
+    reports.
+    """
+
+    reports = []
+    async with Harness(users=users, latency=latency, seed=seed) as harness:
+        for name in workloads or list(harness.workloads):
+            reports.append(await harness.run(
+                name, harness.workloads[name], ops, concurrency))
+    return reports
@@ -0,0 +1,70 @@
+"""Scale test for the ToofPic economy. Builds a synthetic database with
+a given catalog size, user count and ownership density, then drives
+roll, steal and collection through the real command paths.
+"""
+
+import os
+import random
+
+from .harness import Harness, Report, format_row
+
+
+def db_size(dbname: str) -> int:
+    """Returns the size of the database and its journal in bytes."""
+
+    return sum(
+        os.path.getsize(path)
+        for path in (dbname, f"{dbname}-wal", f"{dbname}-journal")
+        if os.path.exists(path))
+
+
+async def run_pics(
+        catalog: int = 500, users: int = 5000, density: float = 0.1,
+        ops: int = 2000, concurrency: int = 50, latency: float = 0.0,
+        seed: int = 0) -> dict:
+    """Runs roll, steal, collection, a mix of the three and 10-pull
+    rolls, and returns their reports along with the database size
+    before and after.
+    """
+
+    async with Harness(
+            users=users, catalog=catalog, density=density,
+            latency=latency, seed=seed) as harness:
+        size_before = db_size(harness.dbname)
+
+        mix_rng = random.Random(seed)
+        workloads = {
+            "roll": harness.roll,
+            "steal": harness.steal,
+            "collection": harness.collection}
+
+        async def mixed():
+            name = mix_rng.choices(list(workloads), weights=[6, 1, 3])[0]
+            await workloads[name]()
+
+        reports: list[Report] = []
+        for name, work in [
+                *workloads.items(), ("mixed", mixed), ("roll-10", harness.ten_pull)]:
+            reports.append(await harness.run(name, work, ops, concurrency))
+
+        return {
+            "catalog": catalog,
+            "users": users,
+            "density": density,
+            "reports": [report.to_dict() for report in reports],
+            "db_size_before": size_before,
+            "db_size_after": db_size(harness.dbname),
+            "queries": {
+                label: histogram.to_dict()
+                for label, histogram in harness.bot.metrics.histograms["db"].items()}}
+
+
+def format_report(result: dict) -> str:
+    lines = [
+        f"catalog {result['catalog']}, users {result['users']}, "
+        f"density {result['density']:.0%}"]
+    lines += [format_row(data) for data in result["reports"]]
+    lines.append(
+        f"db size: {result['db_size_before'] / 1024:.0f} KiB -> "
+        f"{result['db_size_after'] / 1024:.0f} KiB")
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+"""Replays a recording made by toof.recorder through the real gateway
+parsers and cogs. The database is local and HTTP is stubbed, so every
+handler does its real work except for talking to Discord.
+"""
+
+import asyncio
+from collections import Counter
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from toof import ToofBot
+from toof.recorder import STATE_EVENTS, read_events
+
+from .fakes import snowflake
+from .harness import stop_loops
+
+
+class ReplayBot(ToofBot):
+    """A ToofBot that never connects. Its HTTP requests are answered by
+    a stub, and the replay sets it up instead of on_ready.
+    """
+
+    def __init__(self, dbname: str, latency: float = 0.0):
+        super().__init__(dbname)
+        self.replay_delay = latency
+        self.routes: Counter[str] = Counter()
+        self._connection._chunk_guilds = False
+        self.http.request = self.stub_request
+
+    async def on_ready(self):
+        pass
+
+    async def change_presence(self, **kwargs):
+        self.routes["gateway:presence"] += 1
+
+    async def stub_request(self, route, **kwargs):
+        """Answers a request with just enough of a payload for the
+        caller to build its object from.
+        """
+
+        label = f"{route.method} {route.path}"
+        self.routes[label] += 1
+        with self.metrics.timer("http", label):
+            if self.replay_delay:
+                await asyncio.sleep(self.replay_delay)
+
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        if label == "POST /channels/{channel_id}/messages":
+            payload = kwargs.get("json") or {}
+            return {
+                "id": str(snowflake()),
+                "channel_id": str(route.channel_id),
+                "author": self.user_payload(),
+                "content": payload.get("content") or "",
+                "timestamp": now,
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "embeds": payload.get("embeds") or [],
+                "pinned": False,
+                "type": 0}
+        if label == "PATCH /guilds/{guild_id}/members/{user_id}":
+            return {
+                "user": {
+                    "id": str(getattr(route, "user_id", snowflake())),
+                    "username": "member",
+                    "discriminator": "0",
+                    "avatar": None},
+                "roles": (kwargs.get("json") or {}).get("roles", []),
+                "joined_at": now,
+                "deaf": False,
+                "mute": False}
+        if route.method == "GET":
+            return []
+        return None
+
+    def user_payload(self) -> dict:
+        user = self.user
+        return {
+            "id": str(user.id if user else 0),
+            "username": user.name if user else "Toof",
+            "discriminator": "0",
+            "avatar": None,
+            "bot": True}
+
+
+async def replay(
+        path: str, speed: float = 0.0, latency: float = 0.0,
+        dbname: str = None) -> dict:
+    """Feeds the recording at path into a ReplayBot. A speed of 0 runs
+    as fast as possible, 1 at wall-clock speed, 2 at double speed and so
+    on. Returns a report of events per second and what each handler
+    cost.
+    """
+
+    tempdir = None
+    if dbname is None:
+        tempdir = tempfile.TemporaryDirectory()
+        dbname = os.path.join(tempdir.name, "replay.sqlite")
+
+    bot = ReplayBot(dbname, latency)
+    # Binds the client to the running loop, which login would do.
+    await bot._async_setup_hook()
+    await bot.setup_db()
+    await bot.load_cogs(skip={"twitter"})
+    stop_loops(bot)
+
+    parsers = bot._connection.parsers
+    events: Counter[str] = Counter()
+    failures: Counter[str] = Counter()
+    first = None
+    start = time.perf_counter()
+
+    for event, timestamp, data in read_events(path):
+        if speed and first is not None:
+            delay = (timestamp - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if first is None:
+            first = timestamp
+
+        parser = parsers.get(event)
+        if parser is None:
+            continue
+
+        try:
+            with bot.metrics.timer("parse", event):
+                parser(data)
+        except Exception:
+            failures[event] += 1
+        if event not in STATE_EVENTS:
+            events[event] += 1
+        # Lets the handlers the event was dispatched to run.
+        await asyncio.sleep(0)
+
+    pending = [
+        task for task in asyncio.all_tasks()
+        if task is not asyncio.current_task()
+        and task.get_name().startswith("discord.py: ")]
+    await asyncio.gather(*pending, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    for name in list(bot.extensions):
+        await bot.unload_extension(name)
+    await bot.db.close()
+    if tempdir is not None:
+        tempdir.cleanup()
+
+    metrics = bot.metrics.to_dict()["histograms"]
+    return {
+        "events": sum(events.values()),
+        "elapsed": elapsed,
+        "events_per_second": sum(events.values()) / elapsed if elapsed else 0.0,
+        "by_event": dict(events),
+        "parse_failures": dict(failures),
+        "handlers": metrics.get("event", {}),
+        "parsers": metrics.get("parse", {}),
+        "db": metrics.get("db", {}),
+        "http": dict(bot.routes)}
+
+
+def format_report(report: dict, top: int = 15) -> str:
+    """Formats a replay report as a table of the costliest handlers."""
+
+    lines = [
+        f"{report['events']} events in {report['elapsed']:.2f}s "
+        f"({report['events_per_second']:.1f} events/s)"]
+    for section in ["handlers", "db"]:
+        lines.append(f"\n{section} (count, total, p50, p99 in ms):")
+        rows = sorted(
+            report[section].items(), key=lambda item: item[1]["sum"], reverse=True)
+        for label, data in rows[:top]:
+            lines.append(
+                f"  {label[:45]:45} {data['count']:>7} {data['sum'] * 1000:>9.1f} "
+                f"{data['p50'] * 1000:>7.2f} {data['p99'] * 1000:>7.2f}")
+    if report["parse_failures"]:
+        lines.append(f"\nparse failures: {json.dumps(report['parse_failures'])}")
+    return "\n".join(lines)
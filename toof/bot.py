@@ -1,6 +1,7 @@
 """Establishes the bot class."""
 
 import asyncio
+from collections import OrderedDict
 import datetime
 import os
 
@@ -8,7 +9,14 @@ import aiosqlite
 import discord
 from discord.ext.commands import Bot
 
-from .pics import ToofPic, ToofPics, Collection
+from .deferral import AutoDeferResponse, ToofTree
+from .metrics import Metrics, MetricsServer, TimedConnection, instrument_http
+from .pics import (
+    PicRarity, ToofPic, ToofPics, Collection, Ownership,
+    catalog_masks, ordinal)
+from .recorder import GatewayRecorder
+from .roles import DEFAULT_CATEGORIES, ConfigRole, RoleCategory, RoleMenu
+from .watchdog import LoopWatchdog
 
 
 class ToofBot(Bot):
@@ -16,15 +24,33 @@ class ToofBot(Bot):
     connection.
     """
 
-    def __init__(self, dbname: str):
+    def __init__(self, dbname: str, defer_budget: float = 1.5):
         super().__init__(
             command_prefix="NO PREFIX",
             help_command=None,
             intents=discord.Intents.all(),
-            max_messages=5000)
+            max_messages=5000,
+            tree_cls=ToofTree)
 
-        self.db: aiosqlite.Connection = None
+        self.db: TimedConnection = None
         self.dbname = dbname
+        self.guild_configs: dict[int, dict[str, int]] = {}
+        self.role_menus: dict[int, RoleMenu] = {}
+        self.pics_cache: list[ToofPic] | None = None
+        self.user_pics_cache: OrderedDict[int, list[ToofPic]] = OrderedDict()
+        self.pic_masks: dict[str, int] | None = None
+        self.ownership_cache: dict[int, Ownership] = {}
+        # Seconds an interaction can go without a response before it's
+        # deferred, and the response class that does the deferring.
+        self.defer_budget = defer_budget
+        self.defer_response_cls = AutoDeferResponse
+
+        self.metrics = Metrics()
+        self.metrics_server: MetricsServer = None
+        instrument_http(self.http, self.metrics)
+        self.watchdog = LoopWatchdog(
+            self.metrics, debug=bool(os.getenv("TOOFLOOPDEBUG")))
+        self.recorder: GatewayRecorder = None
 
         self.owner_id = 243845903146811393
 
@@ -32,8 +58,53 @@ class ToofBot(Bot):
         super().run(token)
         asyncio.run(self.db.close())
 
+    async def setup_hook(self):
+        self.watchdog.start()
+
+        record_path = os.getenv("TOOFRECORD")
+        if record_path:
+            self.recorder = GatewayRecorder(record_path)
+            self.recorder.install(self._connection)
+            self.recorder.start()
+
+        port = os.getenv("TOOFMETRICSPORT")
+        if port:
+            self.metrics_server = MetricsServer(
+                self, int(port), os.getenv("TOOFMETRICSHOST", "127.0.0.1"))
+            await self.metrics_server.start()
+
+    async def close(self):
+        self.watchdog.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await super().close()
+
+    async def _run_event(self, coro, event_name: str, *args, **kwargs):
+        # Every event and listener goes through here, so they're timed
+        # by the name of the handler, like "VoiceCog.on_voice_state_update".
+        label = getattr(coro, "__qualname__", event_name)
+        with self.metrics.timer("event", label):
+            await super()._run_event(coro, event_name, *args, **kwargs)
+
     async def on_ready(self):
-        self.db = await aiosqlite.connect(self.dbname)
+        await self.setup_db()
+        await self.load_cogs()
+        await self.tree.sync()
+
+        print("""
+ _____             __   ___       _   
+/__   \___   ___  / _| / __\ ___ | |_ 
+  / /\/ _ \ / _ \| |_ /__\/// _ \| __|
+ / / | (_) | (_) |  _/ \/  \ (_) | |_ 
+ \/   \___/ \___/|_| \_____/\___/ \__|""")
+
+    async def setup_db(self):
+        """Connects to the database and creates any missing tables."""
+
+        self.db = TimedConnection(
+            await aiosqlite.connect(self.dbname), self.metrics)
         await self.db.execute("""
             CREATE TABLE IF NOT EXISTS birthdays (
                 user_id INTEGER, 
@@ -45,6 +116,13 @@ class ToofBot(Bot):
                 emoji TEXT,
                 description TEXT, 
                 type TEXT)""")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS role_categories (
+                category_id INTEGER PRIMARY KEY,
+                guild_id INTEGER,
+                name TEXT,
+                emoji TEXT,
+                position INTEGER)""")
         await self.db.execute("""
             CREATE TABLE IF NOT EXISTS pics (
                 user_id INTEGER,
@@ -52,6 +130,12 @@ class ToofBot(Bot):
                 name TEXT,
                 link TEXT,
                 date TEXT)""")
+        # Orders each user's pics by the number in their id, the same
+        # order as the ownership bitsets.
+        await self.db.execute("DROP INDEX IF EXISTS pics_owner")
+        await self.db.execute("""
+            CREATE INDEX IF NOT EXISTS pics_owner_number
+            ON pics (user_id, CAST(substr(pic_id, 2) AS INTEGER))""")
         await self.db.execute("""
             CREATE TABLE IF NOT EXISTS guilds (
                 guild_id INTEGER,
@@ -60,30 +144,85 @@ class ToofBot(Bot):
                 quotes_channel_id INTEGER, 
                 voice_category_id INTEGER,
                 mod_role_id INTEGER, 
-                member_role_id INTEGER)""")
+                member_role_id INTEGER,
+                voice_pool_size INTEGER DEFAULT 1)""")
+        try:
+            await self.db.execute("""
+                ALTER TABLE guilds
+                ADD COLUMN voice_pool_size INTEGER DEFAULT 1""")
+        except aiosqlite.OperationalError:
+            # The column already exists.
+            pass
         await self.db.execute("""
             CREATE TABLE IF NOT EXISTS threads (
-                thread_id INTEGER,
+                thread_id INTEGER PRIMARY KEY,
                 user_id INTEGER)""")
+        # Older databases were made without a primary key on threads.
+        async with self.db.execute("PRAGMA table_info(threads)") as cursor:
+            rows = await cursor.fetchall()
+        thread_id_is_key = any(
+            row[1] == "thread_id" and row[5] for row in rows)
+        if not thread_id_is_key:
+            await self.db.execute("""
+                CREATE TABLE threads_new (
+                    thread_id INTEGER PRIMARY KEY,
+                    user_id INTEGER)""")
+            await self.db.execute(
+                "INSERT OR REPLACE INTO threads_new SELECT * FROM threads")
+            await self.db.execute("DROP TABLE threads")
+            await self.db.execute("ALTER TABLE threads_new RENAME TO threads")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS voice_sessions (
+                guild_id INTEGER,
+                user_id INTEGER,
+                joined REAL,
+                left REAL,
+                seconds INTEGER)""")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS voice_totals (
+                guild_id INTEGER,
+                user_id INTEGER,
+                seconds INTEGER,
+                sessions INTEGER,
+                PRIMARY KEY (guild_id, user_id))""")
+        await self.db.execute("""
+            CREATE INDEX IF NOT EXISTS voice_totals_leaderboard
+            ON voice_totals (guild_id, seconds DESC)""")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS voice_open (
+                guild_id INTEGER,
+                user_id INTEGER,
+                joined REAL,
+                seen REAL,
+                PRIMARY KEY (guild_id, user_id))""")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS owned_pics (
+                user_id INTEGER PRIMARY KEY,
+                bits BLOB)""")
+        # user_version is 1 once the bitsets have been built from the
+        # pics rows, so an empty owned_pics table isn't taken to mean
+        # they never were.
+        async with self.db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version < 1:
+            await self.rebuild_ownership()
+            await self.db.execute("PRAGMA user_version = 1")
         await self.db.commit()
 
+    async def load_cogs(self, skip: set[str] = frozenset()):
+        """Loads every extension in the cogs folder, except the ones
+        named in skip.
+        """
+
         cur_path = os.path.dirname(__file__)
         cogs_dir = os.path.join(cur_path, "cogs")
         for filename in os.listdir(cogs_dir):
-            if filename.endswith(".py") and not filename.startswith("__"):
+            if (filename.endswith(".py") and not filename.startswith("__")
+                    and filename[:-3] not in skip):
                 await self.load_extension(
                     name=f".cogs.{filename[:-3]}",
                     package="toof")
 
-        await self.tree.sync()
-
-        print("""
- _____             __   ___       _   
-/__   \___   ___  / _| / __\ ___ | |_ 
-  / /\/ _ \ / _ \| |_ /__\/// _ \| __|
- / / | (_) | (_) |  _/ \/  \ (_) | |_ 
- \/   \___/ \___/|_| \_____/\___/ \__|""")
-
     async def get_birthday(self, user: discord.User) -> datetime.datetime:
         """Get the given user's birthday by searching the database."""
 
@@ -94,110 +233,306 @@ class ToofBot(Bot):
             return None
         return datetime.datetime.strptime(row[0], "%m/%d/%Y")
 
-    async def get_log_channel(self, guild: discord.Guild):
-        """Get the log channel for the server."""
+    async def get_guild_config(self, guild: discord.Guild) -> dict[str, int] | None:
+        """Get the guild's row of the guilds table as a dict keyed by
+        column name. Rows are cached, so anything that updates the
+        guilds table must call forget_guild_config afterwards.
+        """
 
-        query = f"SELECT log_channel_id FROM guilds WHERE guild_id = {guild.id}"
+        if guild.id in self.guild_configs:
+            self.metrics.count("cache_hit", "guild_config")
+            return self.guild_configs[guild.id]
+        self.metrics.count("cache_miss", "guild_config")
+
+        query = f"SELECT * FROM guilds WHERE guild_id = {guild.id}"
         async with self.db.execute(query) as cursor:
             row = await cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
         if row is None:
             return None
-        return self.get_channel(row[0])
+
+        config = dict(zip(columns, row))
+        self.guild_configs[guild.id] = config
+        return config
+
+    def forget_guild_config(self, guild_id: int):
+        """Drop the cached config for the guild so the next lookup
+        reads it from the database.
+        """
+        self.guild_configs.pop(guild_id, None)
+
+    async def get_role_menu(self, guild: discord.Guild) -> RoleMenu:
+        """Returns the guild's role menu, building it from the database
+        if it isn't cached. Anything that changes a guild's roles or
+        role categories must call forget_role_menu afterwards.
+        """
+
+        if guild.id in self.role_menus:
+            self.metrics.count("cache_hit", "role_menu")
+            return self.role_menus[guild.id]
+        self.metrics.count("cache_miss", "role_menu")
+
+        categories = await self.get_role_categories(guild)
+        query = f"SELECT * FROM roles WHERE guild_id = {guild.id}"
+        async with self.db.execute(query) as cursor:
+            conf_roles = [
+                ConfigRole(
+                    role=guild.get_role(row[1]),
+                    emoji=discord.PartialEmoji.from_str(row[2]),
+                    description=row[3],
+                    type=row[4])
+                async for row in cursor]
+
+        # Skips roles that no longer exist.
+        role_menu = RoleMenu(
+            [conf_role for conf_role in conf_roles if conf_role.role is not None],
+            categories)
+        self.role_menus[guild.id] = role_menu
+        return role_menu
+
+    def forget_role_menu(self, guild_id: int):
+        """Drop the cached role menu for the guild."""
+        self.role_menus.pop(guild_id, None)
+
+    async def get_role_categories(self, guild: discord.Guild) -> list[RoleCategory]:
+        """Returns the guild's role categories in order. Guilds that
+        have none yet get the default categories, plus one for any role
+        type already in use.
+        """
+
+        query = f"""
+            SELECT category_id, name, emoji
+            FROM role_categories
+            WHERE guild_id = {guild.id}
+            ORDER BY position, category_id"""
+        async with self.db.execute(query) as cursor:
+            rows = await cursor.fetchall()
+
+        if not rows:
+            names = [name for name, _ in DEFAULT_CATEGORIES]
+            query = f"SELECT DISTINCT type FROM roles WHERE guild_id = {guild.id}"
+            async with self.db.execute(query) as cursor:
+                extra = [(row[0], "🏷️") async for row in cursor if row[0] not in names]
+
+            await self.db.executemany(
+                "INSERT INTO role_categories (guild_id, name, emoji, position) VALUES (?, ?, ?, ?)",
+                [(guild.id, name, emoji, i)
+                 for i, (name, emoji) in enumerate(DEFAULT_CATEGORIES + extra)])
+            await self.db.commit()
+            return await self.get_role_categories(guild)
+
+        return [
+            RoleCategory(row[0], row[1], discord.PartialEmoji.from_str(row[2]))
+            for row in rows]
+
+    async def get_log_channel(self, guild: discord.Guild):
+        """Get the log channel for the server."""
+
+        config = await self.get_guild_config(guild)
+        if config is None:
+            return None
+        return self.get_channel(config["log_channel_id"])
 
     async def get_mod_role(self, guild: discord.Guild):
         """Get the mod role of the server."""
 
-        query = f"SELECT mod_role_id FROM guilds WHERE guild_id = {guild.id}"
-        async with self.db.execute(query) as cursor:
-            row = await cursor.fetchone()
-        if row is None:
+        config = await self.get_guild_config(guild)
+        if config is None:
             return None
-        return discord.utils.find(lambda r: r.id == row[0], guild.roles)
+        return guild.get_role(config["mod_role_id"])
 
     async def get_quotes_channel(self, guild: discord.Guild):
         """Get the quotes channel of the guild by searching the bot's
         database.
         """
             
-        query = f"""
-            SELECT quotes_channel_id 
-            FROM guilds
-            WHERE guild_id = {guild.id}"""
-        async with self.db.execute(query) as cursor:
-            row = await cursor.fetchone()
-        if row is None:
+        config = await self.get_guild_config(guild)
+        if config is None:
             return None
-        return self.get_channel(row[0])
+        return self.get_channel(config["quotes_channel_id"])
         
     async def get_member_role(self, guild: discord.Guild):
         """Get the member role for the guild."""
 
-        query = f"""
-            SELECT member_role_id
-            FROM guilds
-            WHERE guild_id = {guild.id}"""
-        async with self.db.execute(query) as cursor:
-            row = await cursor.fetchone()
-        if row is None:
+        config = await self.get_guild_config(guild)
+        if config is None:
             return None
-        return discord.utils.find(lambda r: r.id == row[0], guild.roles)
+        return guild.get_role(config["member_role_id"])
 
     async def get_welcome_channel(self, guild: discord.Guild):
         """Gets the welcome channel of the given guild."""
         
-        query = f"""
-            SELECT welcome_channel_id
-            FROM guilds
-            WHERE guild_id = {guild.id}"""
-        async with self.db.execute(query) as cursor:
-            row = await cursor.fetchone()
-        if row is None:
+        config = await self.get_guild_config(guild)
+        if config is None:
             return None
-        return self.get_channel(row[0])
+        return self.get_channel(config["welcome_channel_id"])
         
     async def get_pics(self):
-        """Return a list of all ToofPics by referencing the database."""
+        """Return a list of all ToofPics by referencing the database.
+        The catalog is cached until forget_pics is called.
+        """
+
+        if self.pics_cache is None:
+            self.metrics.count("cache_miss", "pics")
+            query = "SELECT * FROM pics WHERE user_id = 0"
+            async with self.db.execute(query) as cursor:
+                self.pics_cache = [
+                    ToofPic(row[1], row[2], row[3], row[4])
+                    async for row in cursor
+                ]
+        else:
+            self.metrics.count("cache_hit", "pics")
+        return ToofPics(self.pics_cache)
+
+    def forget_pics(self):
+        """Drop the cached catalog of ToofPics."""
+        self.pics_cache = None
+        self.pic_masks = None
+
+    async def get_pic_masks(self) -> dict[str, int]:
+        """Return the catalog's ordinal masks for each rarity. Cached
+        along with the catalog.
+        """
+
+        if self.pic_masks is None:
+            self.pic_masks = catalog_masks(await self.get_pics())
+        return self.pic_masks
+
+    async def get_ownership(self, user_id: int) -> Ownership:
+        """Return the bitset of pics the user owns. Anything that
+        changes it must call save_ownership.
+        """
+
+        if user_id in self.ownership_cache:
+            self.metrics.count("cache_hit", "ownership")
+            return self.ownership_cache[user_id]
+        self.metrics.count("cache_miss", "ownership")
 
-        query = "SELECT * FROM pics WHERE user_id = 0"
+        query = "SELECT bits FROM owned_pics WHERE user_id = ?"
+        async with self.db.execute(query, (user_id,)) as cursor:
+            row = await cursor.fetchone()
+
+        ownership = Ownership.from_bytes(row[0] if row else None)
+        self.ownership_cache[user_id] = ownership
+        return ownership
+
+    async def save_ownership(self, user_id: int, ownership: Ownership):
+        """Write the user's bitset, without committing, so it goes in
+        the same transaction as the change to their pics rows.
+        """
+
+        await self.db.execute(
+            "INSERT OR REPLACE INTO owned_pics VALUES (?, ?)",
+            (user_id, ownership.to_bytes()))
+        self.ownership_cache[user_id] = ownership
+
+    async def rebuild_ownership(self):
+        """Rebuild every user's bitset from their pics rows. Runs once
+        when the owned_pics table is first made. Anything that edits pics
+        rows outside the bot must update the bitsets too, or run this.
+        """
+
+        query = "SELECT user_id, pic_id FROM pics WHERE user_id != 0"
         async with self.db.execute(query) as cursor:
-            list = [
+            owned: dict[int, list[str]] = {}
+            async for user_id, pic_id in cursor:
+                owned.setdefault(user_id, []).append(pic_id)
+
+        await self.db.execute("DELETE FROM owned_pics")
+        await self.db.executemany(
+            "INSERT INTO owned_pics VALUES (?, ?)",
+            [(user_id, Ownership.from_ids(pic_ids).to_bytes())
+             for user_id, pic_ids in owned.items()])
+        await self.db.commit()
+        self.ownership_cache.clear()
+
+    async def get_user_pics(self, user_id: int) -> ToofPics:
+        """Return the sorted ToofPics owned by the user. The most
+        recently used collections are cached until forget_user_pics is
+        called.
+        """
+
+        if user_id in self.user_pics_cache:
+            self.metrics.count("cache_hit", "user_pics")
+            self.user_pics_cache.move_to_end(user_id)
+            return ToofPics(self.user_pics_cache[user_id])
+        self.metrics.count("cache_miss", "user_pics")
+
+        query = f"SELECT * FROM pics WHERE user_id = {user_id}"
+        async with self.db.execute(query) as cursor:
+            usr_pics = sorted([
                 ToofPic(row[1], row[2], row[3], row[4])
                 async for row in cursor
-            ]
-        return ToofPics(list)
+            ])
 
-    async def get_collection(
-            self, user: discord.User,
-            all_pics: ToofPics = ToofPics()):
-        """Returns a menu for the given user by referencing the
-        database.
+        self.user_pics_cache[user_id] = usr_pics
+        if len(self.user_pics_cache) > 256:
+            self.user_pics_cache.popitem(last=False)
+        return ToofPics(usr_pics)
+
+    def forget_user_pics(self, user_id: int):
+        """Drop the user's cached ToofPics."""
+        self.user_pics_cache.pop(user_id, None)
+
+    async def get_collection(self, user: discord.User) -> Collection:
+        """Returns a menu for the given user. Only the ownership bitset
+        is read up front, and pics are loaded from the database a page
+        at a time as the menu reaches them.
         """
 
-        if not all_pics:
-            all_pics = await self.get_pics()
+        masks = await self.get_pic_masks()
 
         if self.user == user:
-            usr_pics = ToofPics(sorted(all_pics))
+            ownership = Ownership(masks["overview"])
+
+            async def loader(
+                    rarity: PicRarity, after: int | None,
+                    limit: int) -> list[ToofPic]:
+                pics = sorted(
+                    (await self.get_pics())[rarity],
+                    key=lambda pic: ordinal(pic.id))
+                return [
+                    pic for pic in pics
+                    if after is None or ordinal(pic.id) > after][:limit]
         else:
-            query = f"SELECT * FROM pics WHERE user_id = {user.id}"
-            async with self.db.execute(query) as cursor:
-                usr_pics = ToofPics(sorted([
-                    ToofPic(row[1], row[2], row[3], row[4])
-                    async for row in cursor
-                ]))
+            ownership = await self.get_ownership(user.id)
 
-        return Collection(usr_pics, all_pics, user)
-    
-    async def get_category(self, guild: discord.Guild) -> discord.CategoryChannel:
+            async def loader(
+                    rarity: PicRarity, after: int | None,
+                    limit: int) -> list[ToofPic]:
+                return await self.get_rarity_pics(user.id, rarity, after, limit)
+
+        return Collection(ownership, masks, user, loader)
+
+    async def get_rarity_pics(
+            self, user_id: int, rarity: PicRarity,
+            after: int = None, limit: int = -1) -> list[ToofPic]:
+        """Return up to limit of the user's ToofPics of the given rarity
+        whose ordinal comes after `after`, in order of ordinal. Uses the
+        pics_owner_number index, so the order matches the bitsets even
+        once ids pass 999.
+        """
+
+        number = "CAST(substr(pic_id, 2) AS INTEGER)"
+        # Ordinals count from 0 and id numbers from 1.
+        start = after + 1 if after is not None else 0
         query = f"""
-            SELECT voice_category_id
-            FROM guilds
-            WHERE guild_id = {guild.id}"""
+            SELECT * FROM pics
+            WHERE user_id = {user_id}
+                AND {number} > {start}
+                AND substr(pic_id, 1, 1) = '{rarity.name[0].upper()}'
+            ORDER BY {number}
+            LIMIT {limit}"""
         async with self.db.execute(query) as cursor:
-            row = await cursor.fetchone()
-        if row is None:
+            return [
+                ToofPic(row[1], row[2], row[3], row[4])
+                async for row in cursor]
+    
+    async def get_category(self, guild: discord.Guild) -> discord.CategoryChannel:
+        config = await self.get_guild_config(guild)
+        if config is None:
             return None
-        return self.get_channel(row[0])
+        return self.get_channel(config["voice_category_id"])
     
     @property
     def toofping_emote(self):
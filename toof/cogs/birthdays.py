@@ -11,6 +11,7 @@ from discord.ext.commands import Cog
 from discord.ext.tasks import loop
 
 import toof
+from toof.concurrency import broadcast
 
 
 class CheckBirthdayContext(discord.app_commands.ContextMenu):
@@ -101,29 +102,32 @@ class BirthdayCog(Cog):
         query = f"SELECT user_id FROM birthdays WHERE birthday LIKE '{now}%'"
         async with self.bot.db.execute(query) as cursor:
             bday_users = [self.bot.get_user(row[0]) async for row in cursor]
+        bday_users = [user for user in bday_users if user is not None]
+        if not bday_users:
+            return
 
-        # Creates a dictionary keying a channel to a list of birthday
-        # users in that channel's guild
         query = "SELECT welcome_channel_id FROM guilds"
         async with self.bot.db.execute(query) as cursor:
-            chan_dict: dict[discord.TextChannel, list[discord.Member]] = {}
-            async for row in cursor:
-                channel = self.bot.get_channel(row[0])
-                users_in_channel = [
-                    member for member in bday_users
-                    if member in channel.members
-                ]
-                if users_in_channel:
-                    chan_dict[channel] = users_in_channel
-
-        # Sends a message to each channel with birthday users
-        for channel, members in chan_dict.items():
-            content = ""
-            for member in members:
-                content += f"{member.mention} "
-            content += "https://tenor.com/view/holiday-classics-elf-christmas-excited-happy-gif-15741376"
-
-            await channel.send(content)
+            channels = [self.bot.get_channel(row[0]) async for row in cursor]
+
+        # Pairs each channel with a message mentioning the birthday
+        # users in that channel's guild
+        messages: list[tuple[discord.TextChannel, str]] = []
+        for channel in channels:
+            if channel is None:
+                continue
+            users_in_channel = [
+                member for member in bday_users
+                if member in channel.members
+            ]
+            if users_in_channel:
+                content = ""
+                for member in users_in_channel:
+                    content += f"{member.mention} "
+                content += "https://tenor.com/view/holiday-classics-elf-christmas-excited-happy-gif-15741376"
+                messages.append((channel, content))
+
+        await broadcast(messages)
 
 
 async def setup(bot: toof.ToofBot):
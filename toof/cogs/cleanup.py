@@ -0,0 +1,135 @@
+"""Extension that cleans up database rows that point at things that no
+longer exist, like roles deleted or members who left while the bot was
+offline. Runs at startup and then on a loop.
+"""
+
+import logging
+
+import discord
+from discord.ext.commands import Cog
+from discord.ext.tasks import loop
+
+import toof
+
+
+log = logging.getLogger(__name__)
+
+
+class CleanupCommand(discord.app_commands.Command):
+    """Runs the cleanup right away and reports what it removed."""
+
+    def __init__(self, bot: toof.ToofBot, cog: "CleanupCog"):
+        super().__init__(
+            name="cleanup",
+            description="Remove stale roles and threads from the database.",
+            callback=self.callback)
+        self.bot = bot
+        self.cog = cog
+
+    async def callback(self, interaction: discord.Interaction):
+        if not await self.bot.is_owner(interaction.user):
+            await interaction.response.send_message("...no", ephemeral=True)
+            return
+
+        removed = await self.cog.cleanup()
+        await interaction.response.send_message(
+            f"removed {removed['roles']} roles and {removed['threads']} threads.",
+            ephemeral=True)
+
+
+class CleanupCog(Cog):
+
+    def __init__(self, bot: toof.ToofBot):
+        bot.tree.add_command(CleanupCommand(bot, self))
+        self.bot = bot
+
+    async def cog_load(self):
+        self.cleanup_loop.start()
+
+    async def cog_unload(self):
+        self.cleanup_loop.cancel()
+
+    @loop(hours=6)
+    async def cleanup_loop(self):
+        await self.cleanup()
+
+    async def cleanup(self) -> dict[str, int]:
+        """Removes stale rows from each table and returns how many were
+        removed from each.
+        """
+
+        removed = {
+            "roles": await self.cleanup_roles(),
+            "threads": await self.cleanup_threads()}
+        log.info(
+            "Cleanup removed %d roles and %d threads.",
+            removed["roles"], removed["threads"])
+        return removed
+
+    async def cleanup_roles(self) -> int:
+        """Deletes rows for roles that no longer exist in guilds the
+        bot can see.
+        """
+
+        guilds = [guild for guild in self.bot.guilds if not guild.unavailable]
+        guild_ids = {guild.id for guild in guilds}
+        live = {(guild.id, role.id) for guild in guilds for role in guild.roles}
+
+        query = "SELECT guild_id, role_id FROM roles"
+        async with self.bot.db.execute(query) as cursor:
+            rows = {(row[0], row[1]) async for row in cursor}
+        stale = {row for row in rows if row[0] in guild_ids} - live
+
+        if stale:
+            await self.bot.db.executemany(
+                "DELETE FROM roles WHERE guild_id = ? AND role_id = ?",
+                stale)
+            await self.bot.db.commit()
+            for guild_id in {row[0] for row in stale}:
+                self.bot.forget_role_menu(guild_id)
+        return len(stale)
+
+    async def cleanup_threads(self) -> int:
+        """Deletes rows for welcome threads whose member has left.
+        Unavailable guilds are skipped, since their members are stale.
+        """
+
+        guilds = [guild for guild in self.bot.guilds if not guild.unavailable]
+        # Rows for uncached threads don't say which guild they're in,
+        # so they're only checked when every guild can be seen.
+        all_available = len(guilds) == len(self.bot.guilds)
+        member_ids = {
+            member.id for guild in guilds
+            for member in guild.members}
+
+        query = "SELECT thread_id, user_id FROM threads"
+        async with self.bot.db.execute(query) as cursor:
+            rows = await cursor.fetchall()
+
+        stale = []
+        for thread_id, user_id in rows:
+            thread = self.bot.get_channel(thread_id)
+            if thread is not None:
+                if (not thread.guild.unavailable
+                        and thread.guild.get_member(user_id) is None):
+                    stale.append((thread_id,))
+            # Archived threads aren't cached, so fall back to checking
+            # every guild.
+            elif all_available and user_id not in member_ids:
+                stale.append((thread_id,))
+
+        if stale:
+            await self.bot.db.executemany(
+                "DELETE FROM threads WHERE thread_id = ?",
+                stale)
+            await self.bot.db.commit()
+
+            welcome_cog = self.bot.get_cog("WelcomeCog")
+            if welcome_cog is not None:
+                for thread_id, in stale:
+                    welcome_cog.threads.pop(thread_id, None)
+        return len(stale)
+
+
+async def setup(bot: toof.ToofBot):
+    await bot.add_cog(CleanupCog(bot))
@@ -41,9 +41,10 @@ class CongfigCog(Cog):
 
     @Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
-        query =f"INSERT INTO guilds VALUES ({guild.id}, 0, 0, 0, 0, 0)"
+        query =f"INSERT INTO guilds VALUES ({guild.id}, 0, 0, 0, 0, 0, 0, 1)"
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(guild.id)
 
 
 async def setup(bot: toof.ToofBot):
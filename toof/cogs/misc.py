@@ -12,6 +12,7 @@ from discord.ext.commands import Cog
 from discord.ext.tasks import loop
 
 import toof
+from toof.concurrency import broadcast
 
 
 class PingCommand(discord.app_commands.Command):
@@ -47,6 +48,14 @@ class RebootCommand(discord.app_commands.Command):
         await interaction.response.send_message(
             f"rewoofing!",
             ephemeral=True)
+        # Unloads the cogs so they can write anything they have
+        # buffered before the process is replaced.
+        for name in list(self.bot.cogs):
+            await self.bot.remove_cog(name)
+        # execv skips close, so the recording is closed here or its
+        # tail is lost.
+        if self.bot.recorder is not None:
+            self.bot.recorder.close()
         os.execv("/usr/bin/sh", ["sh", "start.sh"])
 
 
@@ -114,13 +123,11 @@ class MiscCog(Cog):
 
         query = "SELECT welcome_channel_id FROM guilds"
         async with self.bot.db.execute(query) as cursor:
-            async for row in cursor:
-                try:
-                    await self.bot.get_channel(row[0]).send("https://tenor.com/view/happy-friday-good-morning-friday-morning-gif-13497103")
-                except (AttributeError, discord.HTTPException):
-                    # Either the channel couldn't be found or couldn't
-                    # send to the channel.
-                    pass
+            channels = [self.bot.get_channel(row[0]) async for row in cursor]
+
+        await broadcast([
+            (channel, "https://tenor.com/view/happy-friday-good-morning-friday-morning-gif-13497103")
+            for channel in channels if channel is not None])
 
     @Cog.listener()
     async def on_message(self, msg: discord.Message):
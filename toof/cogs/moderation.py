@@ -12,6 +12,7 @@ from discord.ext.commands import Cog
 from discord.ext.tasks import loop
 
 import toof
+from toof.concurrency import gather
 
 
 class ModLogConfig(discord.app_commands.Group):
@@ -33,6 +34,7 @@ class ModLogConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             "Mod Log disabled.", ephemeral=True)
@@ -47,6 +49,7 @@ class ModLogConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Mod Log set to {interaction.channel.mention}",
@@ -107,7 +110,8 @@ class ModmailCommand(discord.app_commands.Command):
         super().__init__(
             name="modmail",
             description="Something bothering you? Tell the mods.",
-            callback=self.callback)
+            callback=self.callback,
+            extras={"auto_defer": False})
         self.bot = bot
 
     async def callback(self, interaction: discord.Interaction):
@@ -216,8 +220,7 @@ class ModCog(Cog):
             Richardson(guild.get_member(702317272240226324), weight=0.4)   # Brent
         ]
 
-        for r in richardsons:
-            await r.member.remove_roles(mod_role)
+        await gather(*[r.member.remove_roles(mod_role) for r in richardsons])
 
         winner = choices(
             population=[r.member for r in richardsons], 
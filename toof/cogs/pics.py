@@ -4,18 +4,46 @@ they can see their entire collection using /pic collection. Or steal from
 others using /pic steal.
 """
 
+from dataclasses import replace
 from random import randint
+import re
 
 import discord
 
 import toof
+from toof.deferral import auto_defer
 from toof.pics import PicRarity, ToofPic, Collection
 
                 
-class CollectionSelect(discord.ui.Select):
-    """Drop down menu to select the page for Toof pic collection."""
+async def load_collection(
+        interaction: discord.Interaction, user_id: int,
+        page: str = None, index: int = 0) -> Collection:
+    """Rebuilds the collection menu described by a custom_id."""
+
+    if interaction.user.id == user_id:
+        user = interaction.user
+    else:
+        user = (interaction.client.get_user(user_id)
+            or await interaction.client.fetch_user(user_id))
+
+    collection = await interaction.client.get_collection(user)
+    if page is not None:
+        await collection.set_page(page, load=False)
+        await collection.set_index(index)
+    return collection
+
+
+class CollectionSelect(
+        discord.ui.DynamicItem[discord.ui.Select],
+        template=r"toof:collection:(?P<user_id>[0-9]+):select"):
+    """Drop down menu to select the page for Toof pic collection. When
+    rebuilt from a custom_id, the collection is loaded in the callback
+    so it's covered by auto deferral.
+    """
 
-    def __init__(self, collection: Collection, *args, **kwargs):
+    def __init__(
+            self, user_id: int,
+            collection: Collection = None, row: int = None):
         
         options = [
             discord.SelectOption(
@@ -25,82 +53,145 @@ class CollectionSelect(discord.ui.Select):
                 emoji=page.emoji,
                 default=(collection.page == page)
             ) for page in [PicRarity.overview] + PicRarity.list()
-        ]
+        ] if collection is not None else []
         
-        super().__init__(options=options, *args, **kwargs)
+        super().__init__(
+            discord.ui.Select(
+                custom_id=f"toof:collection:{user_id}:select",
+                options=options),
+            row=row)
+        self.user_id = user_id
         self.collection = collection
 
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Select, match: re.Match[str]):
+        return cls(int(match["user_id"]))
+
+    @auto_defer()
     async def callback(self, interaction: discord.Interaction):
         """Changes the page of the menu to the selected option."""
-        
-        self.collection.page = self.values[0]
+
+        collection = await load_collection(interaction, self.user_id)
+        await collection.set_page(self.item.values[0])
                 
         await interaction.response.edit_message(
-            content=self.collection.cur_content,
-            embed=self.collection.cur_embed,
-            view=CollectionView(self.collection))
+            content=collection.cur_content,
+            embed=collection.cur_embed,
+            view=CollectionView(collection))
 
 
-class ChangePicButton(discord.ui.Button):
-    """Changes the current Toof Pic on the message. Functionality
-    is based on the emoji given when initializing.
+class ChangePicButton(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"toof:collection:(?P<user_id>[0-9]+):(?P<page>[a-z]):(?P<index>[0-9]+):(?P<step>prev|next)"):
+    """Changes the current Toof Pic on the message to the previous or
+    next one, depending on the step given when initializing.
     """
 
-    def __init__(self, collection: Collection, *args, **kwargs):
+    def __init__(
+            self, user_id: int, page: str, index: int, step: str,
+            collection: Collection = None, row: int = None):
         super().__init__(
-            disabled=(len(collection.cur_pics) < 2),
-            *args, **kwargs)
-        self.collection = collection
-
+            discord.ui.Button(
+                custom_id=f"toof:collection:{user_id}:{page[0]}:{index}:{step}",
+                emoji="⏪" if step == "prev" else "⏩",
+                disabled=(
+                    collection is not None
+                    and collection.cur_count < 2)),
+            row=row)
+        self.user_id = user_id
+        self.page = page
+        self.index = index
+        self.step = step
+
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Button, match: re.Match[str]):
+        return cls(
+            int(match["user_id"]), match["page"],
+            int(match["index"]), match["step"])
+
+    @auto_defer()
     async def callback(self, interaction: discord.Interaction):
         """Edits the embed to show the next pic."""
 
-        if self.emoji.name == "⏪":
-            self.collection.index -= 1
-        else:
-            self.collection.index += 1
+        step = -1 if self.step == "prev" else 1
+        collection = await load_collection(
+            interaction, self.user_id, self.page, self.index + step)
 
         await interaction.response.edit_message(
-            content=self.collection.cur_content,
-            embed=self.collection.cur_embed,
-            view=CollectionView(self.collection))
+            content=collection.cur_content,
+            embed=collection.cur_embed,
+            view=CollectionView(collection))
 
 
-class ShareButton(discord.ui.Button):
+class ShareButton(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"toof:collection:(?P<user_id>[0-9]+):(?P<page>[a-z]):(?P<index>[0-9]+):share"):
     """Shares the currently selected pic into the interaction
     channel.
     """
 
-    def __init__(self, collection: Collection, *args, **kwargs):
+    def __init__(
+            self, user_id: int, page: str, index: int,
+            collection: Collection = None, row: int = None):
         super().__init__(
-            style=discord.ButtonStyle.primary, label="Share",
-            disabled=(
-                collection.page != PicRarity.overview
-                and not collection.cur_pics),
-            emoji="⤴️", *args, **kwargs)
-        self.collection = collection
-
+            discord.ui.Button(
+                custom_id=f"toof:collection:{user_id}:{page[0]}:{index}:share",
+                style=discord.ButtonStyle.primary, label="Share",
+                disabled=(
+                    collection is not None
+                    and collection.page != PicRarity.overview
+                    and not collection.cur_count),
+                emoji="⤴️"),
+            row=row)
+        self.user_id = user_id
+        self.page = page
+        self.index = index
+
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Button, match: re.Match[str]):
+        return cls(int(match["user_id"]), match["page"], int(match["index"]))
+
+    @auto_defer()
     async def callback(self, interaction: discord.Interaction):
         """Sends the selected Toof Pic into the interaction channel
         with a note that it belongs to the user.
         """
-    
-        await interaction.channel.send(embed=self.collection.cur_embed)
+
+        collection = await load_collection(
+            interaction, self.user_id, self.page, self.index)
+        await interaction.channel.send(embed=collection.cur_embed)
         await interaction.response.defer()
 
 
 class CollectionView(discord.ui.View):
     """Contains a page select button, and buttons to navigate the
-    page.
+    page. The user, page and index are kept in the items' custom_ids,
+    so the view never times out and survives restarts.
     """
 
     def __init__(self, collection: Collection, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        super().__init__(timeout=None, *args, **kwargs)
 
-        self.add_item(CollectionSelect(collection, row=0))
-        self.add_item(ChangePicButton(collection, emoji="⏪", row=1))
-        self.add_item(ChangePicButton(collection, emoji="⏩", row=1))
-        self.add_item(ShareButton(collection, row=1))
+        user_id = collection.user.id
+        page = collection.page.name
+        self.add_item(CollectionSelect(user_id, collection, row=0))
+        self.add_item(ChangePicButton(
+            user_id, page, collection.index, "prev", collection, row=1))
+        self.add_item(ChangePicButton(
+            user_id, page, collection.index, "next", collection, row=1))
+        self.add_item(ShareButton(
+            user_id, page, collection.index, collection, row=1))
+
+
+def roll_cooldown(interaction: discord.Interaction) -> discord.app_commands.Cooldown:
+    """Five seconds per pic rolled, so bigger rolls wait longer."""
+    return discord.app_commands.Cooldown(1, 5 * (interaction.namespace.count or 1))
 
 
 class PicCommandGroup(discord.app_commands.Group):
@@ -114,32 +205,47 @@ class PicCommandGroup(discord.app_commands.Group):
 
     @discord.app_commands.command(
         name="roll",
-        description="Get a random ToofPic.")
-    @discord.app_commands.checks.cooldown(1, 5)
-    async def pic_roll(self, interaction: discord.Interaction):
-        """Selects a rarity based on chance, opens that a file of that
-        rarity, and sends it.
+        description="Get a random ToofPic.",
+        extras={"defer_ephemeral": False})
+    @discord.app_commands.checks.dynamic_cooldown(roll_cooldown)
+    @discord.app_commands.describe(count="How many pics to roll at once.")
+    async def pic_roll(
+            self, interaction: discord.Interaction,
+            count: discord.app_commands.Range[int, 1, 10] = 1):
+        """Selects count pics based on chance and sends them in one
+        message. New pics are saved together in one transaction.
         """
 
         all_pics = await self.bot.get_pics()
-        pic = all_pics.get_random()
-        pic.dt = interaction.created_at
-
-        collection = await self.bot.get_collection(interaction.user, all_pics)
-        if pic not in collection.pics:
-            query = f"""
-                INSERT INTO pics
-                VALUES (
-                    {interaction.user.id}, '{pic.id}', '{pic.name}',
-                    '{pic.link}', '{pic.date}')"""
-            await self.bot.db.execute(query)
+        # Copies the pics so the cached catalog isn't changed.
+        pics = [replace(pic) for pic in all_pics.get_random_many(count)]
+        for pic in pics:
+            pic.dt = interaction.created_at
+
+        ownership = await self.bot.get_ownership(interaction.user.id)
+        new_pics = {}
+        for pic in pics:
+            if pic not in ownership and pic.id not in new_pics:
+                new_pics[pic.id] = pic
+
+        if new_pics:
+            await self.bot.db.executemany(
+                "INSERT INTO pics VALUES (?, ?, ?, ?, ?)",
+                [(interaction.user.id, pic.id, pic.name, pic.link, pic.date)
+                 for pic in new_pics.values()])
+            for pic_id in new_pics:
+                ownership.add(pic_id)
+            await self.bot.save_ownership(interaction.user.id, ownership)
             await self.bot.db.commit()
+            self.bot.forget_user_pics(interaction.user.id)
 
-        await interaction.response.send_message(embed=pic.embed)
+        await interaction.response.send_message(
+            embeds=[pic.embed for pic in pics])
 
     @discord.app_commands.command(
         name="steal",
-        description="Try to steal a ToofPic from another user.")
+        description="Try to steal a ToofPic from another user.",
+        extras={"defer_ephemeral": False})
     @discord.app_commands.checks.cooldown(1, 60)
     async def pic_steal(
             self, interaction: discord.Interaction,
@@ -158,20 +264,17 @@ class PicCommandGroup(discord.app_commands.Group):
                 "u cant steal from urself!", ephemeral=True)
             return
 
-        all_pics = await self.bot.get_pics()
-        user_collection = await self.bot.get_collection(
-            interaction.user, all_pics)
-        target_collection = await self.bot.get_collection(
-            target, all_pics)
+        user_ownership = await self.bot.get_ownership(interaction.user.id)
+        target_pics = await self.bot.get_user_pics(target.id)
         
-        if not target_collection.pics:
+        if not target_pics:
             await interaction.response.send_message(
                 f"{target.mention} doesn't have any pics to steal !", ephemeral=True)
             return
 
-        pic = target_collection.pics.get_random()
+        pic = target_pics.get_random()
         
-        if pic in user_collection.pics:
+        if pic in user_ownership:
             content = f"u tried to steal a {pic.id} from {target.mention}, but u already hav 1!"
             ephemeral = True
         else:
@@ -187,7 +290,15 @@ class PicCommandGroup(discord.app_commands.Group):
                     user_id = {target.id} AND
                     pic_id = '{pic.id}'"""
             await self.bot.db.execute(query)
+
+            target_ownership = await self.bot.get_ownership(target.id)
+            target_ownership.remove(pic.id)
+            user_ownership.add(pic.id)
+            await self.bot.save_ownership(target.id, target_ownership)
+            await self.bot.save_ownership(interaction.user.id, user_ownership)
             await self.bot.db.commit()
+            self.bot.forget_user_pics(interaction.user.id)
+            self.bot.forget_user_pics(target.id)
         
         await interaction.response.send_message(
             content=content, embed=pic.embed, ephemeral=ephemeral)
@@ -250,6 +361,7 @@ class PicAddCommand(discord.app_commands.Command):
             VALUES (0, '{id}', '{name}', '{link}', '{date}')"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_pics()
 
         pic = ToofPic(id, name, link, date)
         await interaction.response.send_message(
@@ -282,7 +394,7 @@ class CheckCollectionContext(discord.app_commands.ContextMenu):
         
         collection = await self.bot.get_collection(member)
         
-        if collection.pics:
+        if collection.num_owned:
             content = None
             embed = collection.cur_embed
         else:
@@ -296,6 +408,7 @@ class CheckCollectionContext(discord.app_commands.ContextMenu):
 
 
 async def setup(bot: toof.ToofBot):
+    bot.add_dynamic_items(CollectionSelect, ChangePicButton, ShareButton)
     bot.tree.add_command(PicCommandGroup(bot))
     bot.tree.add_command(PicAddCommand(bot))
     bot.tree.add_command(CheckCollectionContext(bot))
@@ -27,6 +27,7 @@ class QuotesChannelConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             "Quotes Channel disabled.", ephemeral=True)
@@ -41,6 +42,7 @@ class QuotesChannelConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Quotes Channel set to {interaction.channel.mention}",
@@ -3,150 +3,266 @@ allows moderators to create new roles with descriptions and emojis for
 the users to give to themselves.
 """
 
-from dataclasses import dataclass
+from copy import copy
+import re
 
 import discord
 from discord.ext.commands import Cog
 from emoji import is_emoji
 
 import toof
+from toof.deferral import auto_defer
+from toof.roles import OPTIONS_PER_PAGE, RoleCategory, RoleMenu
 
 
-@dataclass
-class ConfigRole:
-    """Class containing a discord role and information for the roles
-    menu.
-    """
-    
-    role: discord.Role
-    emoji: discord.PartialEmoji
-    description: str
-    type: str
-
-
-class RoleMenu(list[ConfigRole]):
-    """A list of ConfigRoles for the given guild that also contains a
-    "page" attribute.
+class RoleAddSelect(
+        discord.ui.DynamicItem[discord.ui.Select],
+        template=r"toof:roles:select:(?P<category_id>[0-9]+):(?P<page>[0-9]+)"):
+    """discord.ui.Select that contains one page of roles that users
+    can add to themselves. The category and page are kept in the
+    custom_id, so the select still works after a restart.
     """
 
-    def __init__(self, list: list[ConfigRole] = None):
-        super().__init__(list)
-        self.page = "pings"
+    def __init__(
+            self, category_id: int, page: int,
+            options: list[discord.SelectOption], row: int = None):
+        super().__init__(
+            discord.ui.Select(
+                custom_id=f"toof:roles:select:{category_id}:{page}",
+                placeholder="Select Some Roles!",
+                min_values=0,
+                max_values=len(options),
+                options=options),
+            row=row)
 
     @classmethod
-    async def from_db(cls, bot: toof.ToofBot, guild: discord.Guild):
-        """Queries the database to build a role menu for the given
-        guild.
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Select, match: re.Match[str]):
+        return cls(int(match["category_id"]), int(match["page"]), item.options)
+
+    async def callback(self, interaction: discord.Interaction):
+        """Removes roles that the user didn't select and adds the roles
+        that they did select from the menu, all in one request. The
+        select is acknowledged first, so it doesn't need auto_defer.
         """
 
-        query = f"SELECT * FROM roles WHERE guild_id = {guild.id}"
-        async with bot.db.execute(query) as cursor:
-            list = [
-                ConfigRole(
-                    role=discord.utils.find(
-                        lambda r: r.id == row[1], guild.roles),
-                    emoji=discord.PartialEmoji.from_str(row[2]),
-                    description=row[3],
-                    type=row[4])
-                async for row in cursor]
-        
-        return cls(list)
+        await interaction.response.defer()
+
+        page_roles = {
+            role for role in (
+                interaction.guild.get_role(int(option.value))
+                for option in self.item.options)
+            if role is not None}
+        selected = {role for role in page_roles if str(role.id) in self.item.values}
+        # Skips @everyone, which can't be edited.
+        current = set(interaction.user.roles[1:])
+
+        new_roles = (current - page_roles) | selected
+        if new_roles != current:
+            await interaction.user.edit(roles=list(new_roles))
+
+
+class RoleCategoryButton(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"toof:roles:(?P<action>open|category):(?P<category_id>[0-9]+)"):
+    """A button for a role category. In a RoleAddView it changes the
+    current category, and in a RolePickerView it sends the user a
+    RoleAddView for the category.
+    """
 
-    @property
-    def current(self) -> list[ConfigRole]:
-        return [conf_role for conf_role in self if conf_role.type == self.page]
+    def __init__(
+            self, action: str, category_id: int,
+            category: RoleCategory = None,
+            style: discord.ButtonStyle = discord.ButtonStyle.secondary,
+            row: int = None):
+        super().__init__(
+            discord.ui.Button(
+                custom_id=f"toof:roles:{action}:{category_id}",
+                style=style,
+                label=category.label if category else None,
+                emoji=category.emoji if category else None),
+            row=row)
+        self.action = action
+        self.category_id = category_id
 
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Button, match: re.Match[str]):
+        return cls(match["action"], int(match["category_id"]))
 
-class RoleAddSelect(discord.ui.Select):
-    """discord.ui.Select for the given role_type that contains a list
-    of roles that users can add to themselves.
+    @auto_defer()
+    async def callback(self, interaction: discord.Interaction):
+        role_menu = await interaction.client.get_role_menu(interaction.guild)
+        category = role_menu.categories_by_id.get(self.category_id)
+        view = RoleAddView(
+            interaction, role_menu,
+            category.name if category else None)
+
+        if self.action == "open":
+            await interaction.response.send_message(view=view, ephemeral=True)
+        else:
+            await interaction.response.edit_message(view=view)
+
+
+class RoleCategorySelect(
+        discord.ui.DynamicItem[discord.ui.Select],
+        template=r"toof:roles:categories"):
+    """Used in place of RoleCategoryButtons when there are too many
+    categories to fit in a row.
     """
 
     def __init__(
-            self, interaction: discord.Interaction,
-            role_menu: RoleMenu, *args, **kwargs):
-    
+            self, categories: list[RoleCategory] = None,
+            current: str = None, row: int = None):
         options = [
             discord.SelectOption(
-                default=(conf_role.role in interaction.user.roles),
-                label=conf_role.role.name,
-                value=str(conf_role.role.id),
-                description=conf_role.description,
-                emoji=conf_role.emoji)
-            for conf_role in role_menu.current]
-        
+                label=category.label,
+                value=str(category.id),
+                emoji=category.emoji,
+                default=(category.name == current))
+            for category in (categories or [])[:OPTIONS_PER_PAGE]]
         super().__init__(
-            placeholder="Select Some Roles!",
-            min_values=0,
-            max_values=len(options),
-            options=options,
-            *args, **kwargs)
+            discord.ui.Select(custom_id="toof:roles:categories", options=options),
+            row=row)
 
-        self.role_menu = role_menu
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Select, match: re.Match[str]):
+        return cls()
 
+    @auto_defer()
     async def callback(self, interaction: discord.Interaction):
-        """Removes roles that the user didn't select and adds the roles
-        that they did select from the menu.
-        """
-        for role in [cr.role for cr in self.role_menu.current]:
-            if str(role.id) in self.values:
-                await interaction.user.add_roles(role)
-            else:
-                await interaction.user.remove_roles(role)
-        await interaction.response.defer()
+        """Changes the category of the menu to the selected option."""
+
+        role_menu = await interaction.client.get_role_menu(interaction.guild)
+        category = role_menu.categories_by_id.get(int(self.item.values[0]))
+        await interaction.response.edit_message(
+            view=RoleAddView(
+                interaction, role_menu,
+                category.name if category else None))
 
 
-class RoleAddButton(discord.ui.Button):
-    """A button to be added to the RoleAddView that changes the current
-    page.
+class RolePageButton(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"toof:roles:(?P<step>prev|next):(?P<category_id>[0-9]+):(?P<page>[0-9]+)"):
+    """Moves the RoleAddView to the previous or next page of the
+    current category.
     """
 
-    def __init__(self, role_menu: RoleMenu, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.role_menu = role_menu
+    def __init__(
+            self, step: str, category_id: int,
+            page: int, row: int = None):
+        super().__init__(
+            discord.ui.Button(
+                custom_id=f"toof:roles:{step}:{category_id}:{page}",
+                emoji="⏪" if step == "prev" else "⏩"),
+            row=row)
+        self.step = step
+        self.category_id = category_id
+        self.page = page
 
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Button, match: re.Match[str]):
+        return cls(match["step"], int(match["category_id"]), int(match["page"]))
+
+    @auto_defer()
     async def callback(self, interaction: discord.Interaction):
-        """Changes the page of the menu to that of the button."""
-        self.role_menu.page = self.label.lower()
+        role_menu = await interaction.client.get_role_menu(interaction.guild)
+        category = role_menu.categories_by_id.get(self.category_id)
         await interaction.response.edit_message(
-            view=RoleAddView(interaction, self.role_menu))
+            view=RoleAddView(
+                interaction, role_menu,
+                category.name if category else None,
+                self.page + (-1 if self.step == "prev" else 1)))
+
+
+class RolePageLabel(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"toof:roles:page:(?P<category_id>[0-9]+):(?P<page>[0-9]+):(?P<count>[0-9]+)"):
+    """A disabled button showing the RoleAddView's page number. It's a
+    DynamicItem like the rest of the view, since a view with any plain
+    items isn't persistent, and when one times out discord.py drops the
+    dynamic items in it from the bot's registry.
+    """
+
+    def __init__(
+            self, category_id: int, page: int,
+            count: int, row: int = None):
+        super().__init__(
+            discord.ui.Button(
+                custom_id=f"toof:roles:page:{category_id}:{page}:{count}",
+                label=f"{page + 1}/{count}",
+                disabled=True),
+            row=row)
+
+    @classmethod
+    async def from_custom_id(
+            cls, interaction: discord.Interaction,
+            item: discord.ui.Button, match: re.Match[str]):
+        return cls(int(match["category_id"]), int(match["page"]), int(match["count"]))
 
 
 class RoleAddView(discord.ui.View):
-    """View that contains three RoleAddButtons for different role
-    categories and a discord.ui.Select to select roles.
+    """View that contains a button (or a select, if there are a lot of
+    them) for each role category, a select with one page of the current
+    category's roles, and buttons to move between pages. Everything it
+    needs is in its items' custom_ids, so it never times out.
     """
 
     def __init__(
             self, interaction: discord.Interaction,
-            role_menu: RoleMenu, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        
-        self.add_item(RoleAddButton(
-            role_menu=role_menu,
-            style=(discord.ButtonStyle.primary if role_menu.page == "pings"
-                else discord.ButtonStyle.secondary),
-            label="Pings",
-            emoji="🔔",
-            row=0))
-        self.add_item(RoleAddButton(
-            role_menu=role_menu,
-            style=(discord.ButtonStyle.primary if role_menu.page == "gaming"
-                else discord.ButtonStyle.secondary),
-            label="Gaming",
-            emoji="🎮",
-            row=0))
-        self.add_item(RoleAddButton(
-            role_menu=role_menu,
-            style=(discord.ButtonStyle.primary if role_menu.page == "pronouns"
-                else discord.ButtonStyle.secondary),
-            label="Pronouns",
-            emoji="😊",
-            row=0
-        ))
-
-        if role_menu.current:
-            self.add_item(RoleAddSelect(interaction, role_menu, row=1))
+            role_menu: RoleMenu, category: str = None,
+            page: int = 0, *args, **kwargs):
+        super().__init__(timeout=None, *args, **kwargs)
+
+        if role_menu.get_category(category) is None and role_menu.categories:
+            category = role_menu.categories[0].name
+
+        if len(role_menu.categories) <= 5:
+            for conf_category in role_menu.categories:
+                self.add_item(RoleCategoryButton(
+                    "category", conf_category.id, conf_category,
+                    style=(discord.ButtonStyle.primary
+                        if conf_category.name == category
+                        else discord.ButtonStyle.secondary),
+                    row=0))
+        else:
+            self.add_item(RoleCategorySelect(role_menu.categories, category, row=0))
+
+        pages = role_menu.options.get(category, [])
+        if not pages:
+            return
+        page %= len(pages)
+        category_id = role_menu.get_category(category).id
+
+        role_ids = {role.id for role in interaction.user.roles}
+        options = [copy(option) for option in pages[page]]
+        for option in options:
+            option.default = int(option.value) in role_ids
+        self.add_item(RoleAddSelect(category_id, page, options, row=1))
+
+        if len(pages) > 1:
+            self.add_item(RolePageButton("prev", category_id, page, row=2))
+            self.add_item(RolePageLabel(category_id, page, len(pages), row=2))
+            self.add_item(RolePageButton("next", category_id, page, row=2))
+
+
+class RolePickerView(discord.ui.View):
+    """A public message with a button for each role category. Clicking
+    one sends the user their own RoleAddView for that category.
+    """
+
+    def __init__(self, role_menu: RoleMenu, *args, **kwargs):
+        super().__init__(timeout=None, *args, **kwargs)
+
+        for conf_category in role_menu.categories:
+            self.add_item(RoleCategoryButton(
+                "open", conf_category.id, conf_category))
 
 
 class RoleCreateModal(discord.ui.Modal):
@@ -217,6 +333,7 @@ class RoleCreateModal(discord.ui.Modal):
                 '{self.description.value}', '{self.role_type}')"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_role_menu(interaction.guild_id)
 
         await interaction.response.send_message(
             content=f"made {role.mention}!",
@@ -226,7 +343,9 @@ class RoleCreateModal(discord.ui.Modal):
 class RoleDeleteSelect(discord.ui.Select):
     """discord.ui.Select that lists roles for moderators to delete."""
 
-    def __init__(self, role_menu: RoleMenu, *args, **kwargs):
+    def __init__(
+            self, role_menu: RoleMenu, category: str,
+            page: int, *args, **kwargs):
         
         options = [
             discord.SelectOption(
@@ -234,7 +353,7 @@ class RoleDeleteSelect(discord.ui.Select):
                 value=str(config_role.role.id),
                 description=config_role.description,
                 emoji="❌")
-            for config_role in role_menu.current]
+            for config_role in role_menu.pages[category][page]]
         
         super().__init__(
             placeholder="Choose a role to delete.", min_values=0,
@@ -245,21 +364,47 @@ class RoleDeleteSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
         """Asks the user to confirm if they wish to delete the role."""
 
-        role = discord.utils.find(
-            lambda r: r.id == int(self.values[0]),
-            [cr.role for cr in self.role_menu.current])
+        role = interaction.guild.get_role(int(self.values[0]))
         await interaction.response.edit_message(
             content=f"delete {role.mention}?",
             view=RoleDeleteConfirmView(role),)
 
 
+class RoleDeletePageButton(discord.ui.Button):
+    """Moves the RoleDeleteView to a different page."""
+
+    def __init__(self, step: int, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.step = step
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.edit_message(
+            view=RoleDeleteView(
+                self.view.role_menu, self.view.category,
+                self.view.page + self.step))
+
+
 class RoleDeleteView(discord.ui.View):
-    """View that contains the RoleDeleteSelect menu."""
+    """View that contains the RoleDeleteSelect menu for one page of the
+    category, and buttons to change the page if there is more than one.
+    """
 
-    def __init__(self, role_menu: RoleMenu, *args, **kwargs):
+    def __init__(
+            self, role_menu: RoleMenu, category: str,
+            page: int = 0, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.add_item(RoleDeleteSelect(role_menu))
+        pages = role_menu.pages[category]
+        self.role_menu = role_menu
+        self.category = category
+        self.page = page % len(pages)
+
+        self.add_item(RoleDeleteSelect(role_menu, category, self.page))
+        if len(pages) > 1:
+            self.add_item(RoleDeletePageButton(-1, emoji="⏪", row=2))
+            self.add_item(discord.ui.Button(
+                label=f"{self.page + 1}/{len(pages)}", disabled=True, row=2))
+            self.add_item(RoleDeletePageButton(1, emoji="⏩", row=2))
 
 
 class RoleDeleteConfirmView(discord.ui.View):
@@ -312,7 +457,7 @@ class RolesCommand(discord.app_commands.Command):
         self.bot = bot
 
     async def callback(self, interaction: discord.Interaction):
-        guild_role_menu = await RoleMenu.from_db(self.bot, interaction.guild)
+        guild_role_menu = await self.bot.get_role_menu(interaction.guild)
         await interaction.response.send_message(
             view=RoleAddView(interaction, guild_role_menu),
             ephemeral=True)
@@ -331,44 +476,138 @@ class RolesConfig(discord.app_commands.Group):
 
     @discord.app_commands.command(
         name="create",
-        description="Create a role that users can give themselves.")
-    @discord.app_commands.choices(type=[
-        discord.app_commands.Choice(name="Pings", value=1),
-        discord.app_commands.Choice(name="Gaming", value=2),
-        discord.app_commands.Choice(name="Pronouns", value=3)])
-    @discord.app_commands.describe(type="What type of role to create.")
+        description="Create a role that users can give themselves.",
+        extras={"auto_defer": False})
+    @discord.app_commands.describe(category="What category of role to create.")
     async def createrole_command(
             self, interaction: discord.Interaction,
-            type: discord.app_commands.Choice[int]):
-        """Sends the user a modal to create a new role of a given
-        type.
+            category: str):
+        """Sends the user a modal to create a new role in a given
+        category.
         """
         
+        role_menu = await self.bot.get_role_menu(interaction.guild)
+        conf_category = role_menu.get_category(category)
+        if conf_category is None:
+            await interaction.response.send_message(
+                "that category doesnt exist!", ephemeral=True)
+            return
+
         await interaction.response.send_modal(
             RoleCreateModal(
-                self.bot, type.name.lower(),
-                title=f"Create a new {type.name} role:"))
+                self.bot, conf_category.name,
+                title=f"Create a new {conf_category.label} role:"))
     
     @discord.app_commands.command(
         name="delete",
         description="Get rid of a certain role.")
-    @discord.app_commands.choices(type=[
-        discord.app_commands.Choice(name="Pings", value=1),
-        discord.app_commands.Choice(name="Gaming", value=2),
-        discord.app_commands.Choice(name="Pronouns", value=3)])
-    @discord.app_commands.describe(type="What type of role to delete.")
+    @discord.app_commands.describe(category="What category of role to delete.")
     async def deleterole_command(
             self, interaction: discord.Interaction,
-            type: discord.app_commands.Choice[int]):
+            category: str):
         """Sends the user a menu to select a role to delete."""
         
-        guild_role_menu = await RoleMenu.from_db(self.bot, interaction.guild)
-        guild_role_menu.page = type.name.lower()
+        role_menu = await self.bot.get_role_menu(interaction.guild)
+        if not role_menu.pages.get(category):
+            await interaction.response.send_message(
+                "there arent any roles in that category!", ephemeral=True)
+            return
         
         await interaction.response.send_message(
-            view=RoleDeleteView(guild_role_menu),
+            view=RoleDeleteView(role_menu, category),
             ephemeral=True)
 
+    @discord.app_commands.command(
+        name="category-add",
+        description="Add a new category to the roles menu.")
+    @discord.app_commands.describe(
+        name="What the category is called.",
+        emoji="Emoji to represent this category in menus.")
+    async def addcategory_command(
+            self, interaction: discord.Interaction,
+            name: str, emoji: str):
+        """Adds a category to the end of the guild's roles menu."""
+
+        if not is_emoji(emoji):
+            await interaction.response.send_message(
+                "Invalid emoji. Try again.", ephemeral=True)
+            return
+
+        name = name.lower()
+        role_menu = await self.bot.get_role_menu(interaction.guild)
+        if role_menu.get_category(name) is not None:
+            await interaction.response.send_message(
+                "that category already exists!", ephemeral=True)
+            return
+        if len(role_menu.categories) >= OPTIONS_PER_PAGE:
+            await interaction.response.send_message(
+                "u hav too many categories!", ephemeral=True)
+            return
+
+        await self.bot.db.execute(
+            "INSERT INTO role_categories (guild_id, name, emoji, position) VALUES (?, ?, ?, ?)",
+            (interaction.guild_id, name, emoji, len(role_menu.categories)))
+        await self.bot.db.commit()
+        self.bot.forget_role_menu(interaction.guild_id)
+
+        await interaction.response.send_message(
+            f"added {emoji} {name.title()}!", ephemeral=True)
+
+    @discord.app_commands.command(
+        name="category-remove",
+        description="Remove an empty category from the roles menu.")
+    @discord.app_commands.describe(category="The category to remove.")
+    async def removecategory_command(
+            self, interaction: discord.Interaction,
+            category: str):
+        """Removes a category that has no roles left in it."""
+
+        role_menu = await self.bot.get_role_menu(interaction.guild)
+        conf_category = role_menu.get_category(category)
+        if conf_category is None:
+            await interaction.response.send_message(
+                "that category doesnt exist!", ephemeral=True)
+            return
+        if role_menu.pages.get(category):
+            await interaction.response.send_message(
+                "delete the roles in that category first!", ephemeral=True)
+            return
+
+        query = f"DELETE FROM role_categories WHERE category_id = {conf_category.id}"
+        await self.bot.db.execute(query)
+        await self.bot.db.commit()
+        self.bot.forget_role_menu(interaction.guild_id)
+
+        await interaction.response.send_message(
+            f"removed {conf_category.label}.", ephemeral=True)
+
+    @discord.app_commands.command(
+        name="post",
+        description="Post a roles menu in this channel for everyone to use.")
+    async def post_command(self, interaction: discord.Interaction):
+        """Sends a RolePickerView into the channel."""
+
+        role_menu = await self.bot.get_role_menu(interaction.guild)
+        await interaction.channel.send(
+            content="Pick a category to give yourself some roles!",
+            view=RolePickerView(role_menu))
+        await interaction.response.send_message("posted!", ephemeral=True)
+
+    @createrole_command.autocomplete("category")
+    @deleterole_command.autocomplete("category")
+    @removecategory_command.autocomplete("category")
+    async def category_autocomplete(
+            self, interaction: discord.Interaction,
+            current: str) -> list[discord.app_commands.Choice[str]]:
+        """Suggests the guild's role categories."""
+
+        role_menu = await self.bot.get_role_menu(interaction.guild)
+        return [
+            discord.app_commands.Choice(name=category.label, value=category.name)
+            for category in role_menu.categories
+            if current.lower() in category.name.lower()
+        ][:OPTIONS_PER_PAGE]
+
     @discord.app_commands.command(
         name="member",
         description="Set the member role for the server.")
@@ -383,6 +622,7 @@ class RolesConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Member role set to {role.mention}",
@@ -402,6 +642,7 @@ class RolesConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Mod role set to {role.mention}",
@@ -419,7 +660,17 @@ class RolesCog(Cog):
         query = f"DELETE FROM roles WHERE role_id = {role.id}"
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_role_menu(role.guild.id)
+
+    @Cog.listener()
+    async def on_guild_role_update(
+            self, before: discord.Role,
+            after: discord.Role):
+        self.bot.forget_role_menu(after.guild.id)
 
 
 async def setup(bot: toof.ToofBot):
+    bot.add_dynamic_items(
+        RoleAddSelect, RoleCategoryButton,
+        RoleCategorySelect, RolePageButton, RolePageLabel)
     await bot.add_cog(RolesCog(bot))
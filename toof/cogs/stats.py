@@ -0,0 +1,184 @@
+"""Extension that lets the owner see how long commands, events, queries
+and requests are taking, how laggy the event loop has been, and profile
+the bot while it runs.
+"""
+
+import asyncio
+import datetime
+import io
+import json
+
+import discord
+from discord.ext.commands import Cog
+
+import toof
+from toof.profiling import profile_cpu, profile_memory
+
+
+KINDS = ["command", "component", "event", "db", "http"]
+
+
+class StatsCommand(discord.app_commands.Command):
+    """Shows the slowest handlers of each kind, or dumps everything as
+    JSON.
+    """
+
+    def __init__(self, bot: toof.ToofBot):
+        super().__init__(
+            name="stats",
+            description="See where Toof spends his time.",
+            callback=self.callback)
+        self.bot = bot
+
+    @discord.app_commands.describe(
+        dump="Attach every metric as a JSON file.")
+    async def callback(
+            self, interaction: discord.Interaction,
+            dump: bool = False):
+        if not await self.bot.is_owner(interaction.user):
+            await interaction.response.send_message("...no", ephemeral=True)
+            return
+
+        if dump:
+            data = json.dumps(self.bot.metrics.to_dict(), indent=2)
+            await interaction.response.send_message(
+                file=discord.File(io.BytesIO(data.encode()), "stats.json"),
+                ephemeral=True)
+            return
+
+        lines = []
+        for kind in KINDS:
+            top = self.bot.metrics.top(kind)
+            if not top:
+                continue
+            lines.append(f"{kind} (count, p50, p99, max in ms):")
+            for label, histogram in top:
+                lines.append(
+                    f"  {label[:40]:40} {histogram.count:>6} "
+                    f"{histogram.quantile(0.5) * 1000:>7.1f} "
+                    f"{histogram.quantile(0.99) * 1000:>7.1f} "
+                    f"{histogram.max * 1000:>7.1f}")
+
+        auto_defers = sum(self.bot.metrics.counters["auto_defer"].values())
+        lines.append(f"auto defers: {auto_defers}")
+
+        content = "\n".join(lines)[:1990]
+        await interaction.response.send_message(
+            f"```\n{content}```", ephemeral=True)
+
+
+class LagCommand(discord.app_commands.Command):
+    """Shows recent event loop lag and the stalls the watchdog caught."""
+
+    def __init__(self, bot: toof.ToofBot):
+        super().__init__(
+            name="lag",
+            description="See how laggy Toof has been.",
+            callback=self.callback)
+        self.bot = bot
+
+    @discord.app_commands.describe(
+        stacks="Attach the stack of each recent stall.")
+    async def callback(
+            self, interaction: discord.Interaction,
+            stacks: bool = False):
+        if not await self.bot.is_owner(interaction.user):
+            await interaction.response.send_message("...no", ephemeral=True)
+            return
+
+        watchdog = self.bot.watchdog
+        lines = [f"lag threshold: {watchdog.threshold * 1000:.0f}ms"]
+        for name, seconds in [("5m", 300), ("1h", 3600)]:
+            summary = watchdog.summary(seconds)
+            lines.append(
+                f"{name}: max {summary['max'] * 1000:.1f}ms, "
+                f"avg {summary['average'] * 1000:.1f}ms "
+                f"over {summary['samples']} samples")
+
+        lines.append(f"stalls: {len(watchdog.stalls)}")
+        for stall in list(watchdog.stalls)[-5:]:
+            at = datetime.datetime.fromtimestamp(stall.time).strftime("%H:%M:%S")
+            where = [
+                line.strip() for line in stall.stack.splitlines()
+                if line.lstrip().startswith("File")][-1]
+            lines.append(f"  {at} {stall.lag:.2f}s {stall.task}: {where}")
+
+        content = "\n".join(lines)[:1990]
+        file = discord.utils.MISSING
+        if stacks and watchdog.stalls:
+            data = "\n\n".join(
+                f"{stall.time} {stall.lag:.3f}s {stall.task}\n{stall.stack}"
+                for stall in watchdog.stalls)
+            file = discord.File(io.BytesIO(data.encode()), "stalls.txt")
+
+        await interaction.response.send_message(
+            f"```\n{content}```", file=file, ephemeral=True)
+
+
+class ProfileCommandGroup(discord.app_commands.Group):
+    """Profiles the running bot for a while and sends the results as
+    files. Only one profile runs at a time.
+    """
+
+    def __init__(self, bot: toof.ToofBot):
+        super().__init__(
+            name="profile",
+            description="Profile Toof while he runs.")
+        self.bot = bot
+        self.lock = asyncio.Lock()
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if not await self.bot.is_owner(interaction.user):
+            await interaction.response.send_message("...no", ephemeral=True)
+            return False
+        if self.lock.locked():
+            await interaction.response.send_message(
+                "already profiling!", ephemeral=True)
+            return False
+        return True
+
+    @discord.app_commands.command(
+        name="cpu",
+        description="Sample what Toof is running and send collapsed stacks.")
+    @discord.app_commands.describe(seconds="How long to sample for.")
+    async def cpu_command(
+            self, interaction: discord.Interaction,
+            seconds: discord.app_commands.Range[int, 1, 120] = 10):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        async with self.lock:
+            profiler = await profile_cpu(seconds)
+
+        await interaction.followup.send(
+            content=f"```\n{profiler.top()[:1990]}```",
+            files=[
+                discord.File(
+                    io.BytesIO(profiler.collapsed().encode()),
+                    "profile.collapsed")],
+            ephemeral=True)
+
+    @discord.app_commands.command(
+        name="memory",
+        description="Trace what Toof allocates and send the top allocations.")
+    @discord.app_commands.describe(seconds="How long to trace for.")
+    async def memory_command(
+            self, interaction: discord.Interaction,
+            seconds: discord.app_commands.Range[int, 1, 120] = 10):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        async with self.lock:
+            report = await profile_memory(seconds)
+
+        await interaction.followup.send(
+            file=discord.File(io.BytesIO(report.encode()), "allocations.txt"),
+            ephemeral=True)
+
+
+class StatsCog(Cog):
+
+    def __init__(self, bot: toof.ToofBot):
+        bot.tree.add_command(StatsCommand(bot))
+        bot.tree.add_command(LagCommand(bot))
+        bot.tree.add_command(ProfileCommandGroup(bot))
+
+
+async def setup(bot: toof.ToofBot):
+    await bot.add_cog(StatsCog(bot))
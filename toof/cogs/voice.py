@@ -1,16 +1,23 @@
 """Extension that includes voice functionality. Used to be a music bot,
-now just tracks how long users were in a channel for.
+now just tracks how long users were in a channel for and keeps the
+guild's voice category stocked with empty channels.
 """
 
+import asyncio
 import datetime
+import logging
 
 import discord
 from discord.ext.commands import Cog
+from discord.ext.tasks import loop
 from num2words import num2words
 
 import toof
 
 
+log = logging.getLogger(__name__)
+
+
 class VoiceConfig(discord.app_commands.Group):
 
     def __init__(self, bot: toof.ToofBot):
@@ -29,6 +36,7 @@ class VoiceConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             "Channel Category Log disabled.", ephemeral=True)
@@ -51,6 +59,7 @@ class VoiceConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Channel Category set.", ephemeral=True)
@@ -68,127 +77,526 @@ class VoiceConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             "Channel Category created.", ephemeral=True)
 
+    @discord.app_commands.command(
+        name="pool",
+        description="Set how many empty voice channels to keep ready.")
+    @discord.app_commands.describe(size="Number of empty channels.")
+    async def pool_command(
+            self, interaction: discord.Interaction,
+            size: discord.app_commands.Range[int, 1, 10]):
+        query = f"""
+            UPDATE guilds
+            SET voice_pool_size = {size}
+            WHERE guild_id = {interaction.guild_id}"""
+        await self.bot.db.execute(query)
+        await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
+
+        voice_cog = self.bot.get_cog("VoiceCog")
+        if voice_cog is not None:
+            voice_cog.schedule_reconcile(interaction.guild)
+
+        await interaction.response.send_message(
+            f"Keeping {size} empty channels ready.", ephemeral=True)
+
+
+class VoiceLog:
+    """Keeps track of when members joined voice and records their
+    sessions. Finished sessions and changes to who is in voice are
+    buffered and written to the database in batches, along with a
+    running total for each member of each guild.
+    """
+
+    def __init__(self, bot: toof.ToofBot, batch_size: int = 50):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.join_times: dict[tuple[int, int], datetime.datetime] = {}
+
+        # Sessions waiting to be written as (guild_id, user_id, joined,
+        # left, seconds).
+        self.pending_sessions: list[tuple[int, int, float, float, int]] = []
+        # Changes to voice_open waiting to be written, keyed by
+        # (guild_id, user_id). None means the member left.
+        self.pending_open: dict[tuple[int, int], float | None] = {}
+
+    async def load(self):
+        """Restores the join times of members who were in voice before
+        a restart. Sessions of members who left while the bot was
+        offline are closed at the last time the bot saw them.
+        """
+
+        now = datetime.datetime.now()
+        in_voice = self.get_in_voice()
+
+        query = "SELECT guild_id, user_id, joined, seen FROM voice_open"
+        async with self.bot.db.execute(query) as cursor:
+            rows = await cursor.fetchall()
+
+        for guild_id, user_id, joined, seen in rows:
+            if (guild_id, user_id) in in_voice:
+                self.join_times[(guild_id, user_id)] = (
+                    datetime.datetime.fromtimestamp(joined))
+            else:
+                self.end_session(
+                    guild_id, user_id,
+                    datetime.datetime.fromtimestamp(joined),
+                    datetime.datetime.fromtimestamp(seen))
+
+        for guild_id, user_id in in_voice - self.join_times.keys():
+            self.start_session(guild_id, user_id, now)
+
+        await self.flush()
+
+    def get_in_voice(self) -> set[tuple[int, int]]:
+        """Returns a (guild_id, user_id) pair for every member that is
+        currently in a voice channel.
+        """
+
+        return {
+            (guild.id, member.id)
+            for guild in self.bot.guilds
+            for voice_channel in guild.voice_channels
+            for member in voice_channel.members}
+
+    def reconcile(self):
+        """Ends the sessions of members who left voice and starts
+        sessions for members who joined while events were missed.
+        """
+
+        now = datetime.datetime.now()
+        in_voice = self.get_in_voice()
+        tracked = self.join_times.keys()
+
+        for guild_id, user_id in tracked - in_voice:
+            self.end_session(
+                guild_id, user_id,
+                self.join_times.pop((guild_id, user_id)), now)
+        for guild_id, user_id in in_voice - tracked:
+            self.start_session(guild_id, user_id, now)
+
+    def start_session(
+            self, guild_id: int, user_id: int,
+            joined: datetime.datetime):
+        """Marks the member as in voice from the given time."""
+
+        self.join_times[(guild_id, user_id)] = joined
+        self.pending_open[(guild_id, user_id)] = joined.timestamp()
+
+    def end_session(
+            self, guild_id: int, user_id: int,
+            joined: datetime.datetime, left: datetime.datetime):
+        """Queues the finished session to be written."""
+
+        seconds = max(int((left - joined).total_seconds()), 0)
+        self.pending_sessions.append(
+            (guild_id, user_id, joined.timestamp(), left.timestamp(), seconds))
+        self.pending_open[(guild_id, user_id)] = None
+
+    def leave(self, guild_id: int, user_id: int):
+        """Ends the member's current session."""
+
+        joined = self.join_times.pop((guild_id, user_id))
+        self.end_session(guild_id, user_id, joined, datetime.datetime.now())
+
+    @property
+    def full(self) -> bool:
+        return len(self.pending_sessions) + len(self.pending_open) >= self.batch_size
+
+    async def flush(self):
+        """Writes every buffered change in a single transaction."""
+
+        sessions = self.pending_sessions
+        open_changes = self.pending_open
+        self.pending_sessions = []
+        self.pending_open = {}
+        now = datetime.datetime.now().timestamp()
+
+        await self.bot.db.executemany(
+            "INSERT INTO voice_sessions VALUES (?, ?, ?, ?, ?)",
+            sessions)
+        await self.bot.db.executemany("""
+            INSERT INTO voice_totals VALUES (?, ?, ?, 1)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                seconds = seconds + excluded.seconds,
+                sessions = sessions + 1""",
+            [(s[0], s[1], s[4]) for s in sessions])
+        await self.bot.db.executemany(
+            "DELETE FROM voice_open WHERE guild_id = ? AND user_id = ?",
+            [key for key, joined in open_changes.items() if joined is None])
+        await self.bot.db.executemany(
+            "INSERT OR REPLACE INTO voice_open VALUES (?, ?, ?, ?)",
+            [(*key, joined, now) for key, joined in open_changes.items()
+             if joined is not None])
+        await self.bot.db.execute(f"UPDATE voice_open SET seen = {now}")
+        await self.bot.db.commit()
+
+    async def get_total(
+            self, guild_id: int, user_id: int) -> datetime.timedelta:
+        """Returns how long the member has spent in voice in the guild,
+        including their current session.
+        """
+
+        query = f"""
+            SELECT seconds
+            FROM voice_totals
+            WHERE guild_id = {guild_id} AND user_id = {user_id}"""
+        async with self.bot.db.execute(query) as cursor:
+            row = await cursor.fetchone()
+        seconds = row[0] if row is not None else 0
+
+        # Sessions that haven't been written yet.
+        seconds += sum(
+            s[4] for s in self.pending_sessions
+            if s[0] == guild_id and s[1] == user_id)
+        total = datetime.timedelta(seconds=seconds)
+
+        if (guild_id, user_id) in self.join_times:
+            total += datetime.datetime.now() - self.join_times[(guild_id, user_id)]
+        return total
+
+    async def get_leaderboard(
+            self, guild_id: int,
+            limit: int = 10) -> list[tuple[int, datetime.timedelta]]:
+        """Returns the members with the most time in voice in the
+        guild as (user_id, total) pairs.
+        """
+
+        await self.flush()
+        query = f"""
+            SELECT user_id, seconds
+            FROM voice_totals
+            WHERE guild_id = {guild_id}
+            ORDER BY seconds DESC
+            LIMIT {limit}"""
+        async with self.bot.db.execute(query) as cursor:
+            return [
+                (row[0], datetime.timedelta(seconds=row[1]))
+                async for row in cursor]
+
+
+class CategoryReconciler:
+    """Keeps a guild's voice category laid out as every occupied
+    channel plus a warm pool of empty channels, named "voice one",
+    "voice two", etc. in order. Voice events only schedule a pass, which
+    runs once things have been quiet for `delay` seconds, so a burst of
+    joins and leaves ends in a single pass that makes only the changes
+    it needs. A busy category still gets a pass at least every
+    `max_wait` seconds.
+
+    When the last empty channel fills, a pass is run right away so
+    joining never waits on a new one. Extra empty channels are only
+    deleted once they've been spare for `trim_delay` seconds.
+    """
+
+    def __init__(
+            self, bot: toof.ToofBot, guild: discord.Guild,
+            delay: float = 2.0, trim_delay: float = 300.0,
+            max_wait: float = 10.0):
+        self.bot = bot
+        self.guild = guild
+        self.delay = delay
+        self.trim_delay = trim_delay
+        self.max_wait = max_wait
+
+        self.dirty = False
+        self.deadline = 0.0
+        # When the first event since the last pass came in.
+        self.dirty_since: float | None = None
+        # Wakes a waiting pass when the deadline is brought forward.
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+        # When the category first had more empty channels than the
+        # pool size, and the pass scheduled to trim them.
+        self.surplus_since: float | None = None
+        self.trim_handle: asyncio.TimerHandle | None = None
+
+        # Channels we created or deleted that the gateway hasn't told
+        # the cache about yet.
+        self.created: dict[int, discord.VoiceChannel] = {}
+        self.deleted: set[int] = set()
+
+    def schedule(self, immediate: bool = False):
+        """Requests a pass, pushing back any pass that is waiting, but
+        no further than max_wait after the first event it's waiting on.
+        An immediate pass runs as soon as the loop gets to it.
+        """
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if not self.dirty or self.dirty_since is None:
+            self.dirty_since = now
+        self.dirty = True
+        if immediate:
+            self.deadline = now
+            self.wakeup.set()
+        else:
+            self.deadline = min(now + self.delay, self.dirty_since + self.max_wait)
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while self.dirty:
+            while (remaining := self.deadline - loop.time()) > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+            self.dirty = False
+            self.dirty_since = None
+            try:
+                await self.reconcile()
+            except discord.HTTPException as error:
+                log.warning("Couldn't update voice channels in %s: %r", self.guild, error)
+
+    def get_channels(
+            self, category: discord.CategoryChannel) -> list[discord.VoiceChannel]:
+        """Returns the category's voice channels in order, accounting
+        for changes the cache hasn't caught up with.
+        """
+
+        channels = category.voice_channels
+        cached_ids = {channel.id for channel in channels}
+        self.deleted &= cached_ids
+        for id in cached_ids & self.created.keys():
+            del self.created[id]
+
+        return [c for c in channels if c.id not in self.deleted] + list(self.created.values())
+
+    def is_full(self, category: discord.CategoryChannel) -> bool:
+        """Whether every voice channel in the category is occupied."""
+
+        return all(channel.members for channel in self.get_channels(category))
+
+    def get_surplus(self, count: int) -> int:
+        """Returns how many spare empty channels can be deleted now.
+        The first time there are spares, schedules a pass for when they
+        can be trimmed instead.
+        """
+
+        loop = asyncio.get_running_loop()
+        if count <= 0:
+            self.surplus_since = None
+            return 0
+        if self.surplus_since is None:
+            self.surplus_since = loop.time()
+            if self.trim_handle is not None:
+                self.trim_handle.cancel()
+            self.trim_handle = loop.call_later(self.trim_delay, self.schedule)
+            return 0
+        if loop.time() - self.surplus_since < self.trim_delay:
+            return 0
+        self.surplus_since = None
+        return count
+
+    async def reconcile(self):
+        """Creates, deletes, renames and reorders only the channels
+        that differ from the target layout.
+        """
+
+        category = await self.bot.get_category(self.guild)
+        if not isinstance(category, discord.CategoryChannel):
+            return
+        config = await self.bot.get_guild_config(self.guild)
+        pool_size = max(config["voice_pool_size"] or 1, 1)
+
+        channels = self.get_channels(category)
+        empty_channels = [c for c in channels if not c.members]
+
+        # Delete spare empty channels from the end of the category.
+        surplus = self.get_surplus(len(empty_channels) - pool_size)
+        spares = empty_channels[len(empty_channels) - surplus:] if surplus else []
+        for channel in spares:
+            await channel.delete()
+            self.deleted.add(channel.id)
+        layout = [c for c in channels if c not in spares]
+
+        # Rename channels whose name doesn't match their spot.
+        for i, channel in enumerate(layout):
+            name = f"voice {num2words(i + 1)}"
+            if channel.name != name:
+                await channel.edit(name=name)
+
+        # Refill the pool.
+        for _ in range(pool_size - len(empty_channels)):
+            channel = await category.create_voice_channel(
+                f"voice {num2words(len(layout) + 1)}")
+            self.created[channel.id] = channel
+            layout.append(channel)
+
+        # Fix the order in one request if positions are out of order.
+        positions = [c.position for c in layout]
+        if any(a >= b for a, b in zip(positions, positions[1:])):
+            await self.bot.http.bulk_channel_update(
+                self.guild.id,
+                [{"id": c.id, "position": positions[0] + i}
+                 for i, c in enumerate(layout)])
+
+
+def format_duration(delta: datetime.timedelta) -> str:
+    """Formats the timedelta as days, hours, minutes and seconds."""
+
+    seconds = delta.seconds
+    days = delta.days
+
+    hours = seconds // 3600
+    seconds -= hours * 3600
+    minutes = seconds // 60
+    seconds -= minutes * 60
+
+    string = ""
+    if days > 0:
+        string += f"{days} days, "
+    string += f"{hours} hours, {minutes} mins, and {seconds} seconds"
+    return string
+
 
 class CheckVoiceContext(discord.app_commands.ContextMenu):
     """Checks how long a given user has been in a voice channel."""
 
-    def __init__(
-            self, bot: toof.ToofBot,
-            id_time_dict: dict[int, datetime.datetime]):
+    def __init__(self, bot: toof.ToofBot, voice_log: VoiceLog):
         super().__init__(name="Check Voice Time", callback=self.callback)
         self.guild_only = True
         self.bot = bot
-        self.id_time_dict = id_time_dict
+        self.voice_log = voice_log
 
     async def callback(
             self, interaction: discord.Interaction,
             member: discord.Member):
         
-        if member.id not in self.id_time_dict:
-            await interaction.response.send_message(
-                content=f"{member.mention} isnt in a voice !", 
-                ephemeral=True)
-            return
-
-        delta = datetime.datetime.now() - self.id_time_dict[member.id]
+        total = await self.voice_log.get_total(member.guild.id, member.id)
 
-        seconds = delta.seconds
-        days = delta.days
-
-        hours = seconds // 3600
-        seconds -= hours * 3600
-        minutes = seconds // 60
-        seconds -= minutes * 60
-
-        string = f"woof! {member.mention} haz been in call for "
-        if days > 0:
-            string += f"{days} days, "
-        string += f"{hours} hours, {minutes} mins, and {seconds} seconds"
+        key = (member.guild.id, member.id)
+        if key not in self.voice_log.join_times:
+            string = f"{member.mention} isnt in a voice !"
+        else:
+            delta = datetime.datetime.now() - self.voice_log.join_times[key]
+            string = f"woof! {member.mention} haz been in call for {format_duration(delta)}"
+        string += f"\n(total: {format_duration(total)})"
 
         await interaction.response.send_message(
             content=string,
             ephemeral=True)
 
 
+class VoiceCommandGroup(discord.app_commands.Group):
+    """Commands relating to time spent in voice."""
+
+    def __init__(self, bot: toof.ToofBot, voice_log: VoiceLog):
+        super().__init__(
+            name="voice",
+            description="See how long people have been in voice.",
+            guild_only=True)
+        self.bot = bot
+        self.voice_log = voice_log
+
+    @discord.app_commands.command(
+        name="leaderboard",
+        description="See who has spent the most time in voice.")
+    async def leaderboard_command(self, interaction: discord.Interaction):
+        leaderboard = await self.voice_log.get_leaderboard(interaction.guild_id)
+
+        if not leaderboard:
+            await interaction.response.send_message(
+                "nobody haz been in voice yet !", ephemeral=True)
+            return
+
+        embed = discord.Embed(
+            color=discord.Color.blurple(),
+            title="Voice Leaderboard:",
+            description="")
+        for i, (user_id, total) in enumerate(leaderboard):
+            embed.description += f"**{i + 1}.** <@{user_id}> - {format_duration(total)}\n"
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
 class VoiceCog(Cog):
 
     def __init__(self, bot: toof.ToofBot):
-        
-        now = datetime.datetime.now()
-        self.id_time_dict: dict[int, datetime.datetime] = {}
-        for guild in bot.guilds:
-            for voice_channel in guild.voice_channels:
-                for member in voice_channel.members:
-                    self.id_time_dict[member.id] = now
-        
-        bot.tree.add_command(CheckVoiceContext(bot, self.id_time_dict))
+        self.voice_log = VoiceLog(bot)
+        self.reconcilers: dict[int, CategoryReconciler] = {}
+
+        bot.tree.add_command(CheckVoiceContext(bot, self.voice_log))
+        bot.tree.add_command(VoiceCommandGroup(bot, self.voice_log))
         self.bot = bot
+
+    async def cog_load(self):
+        await self.voice_log.load()
+        self.flush_voice_log.start()
+
+        # Fills each guild's pool of empty channels.
+        for guild in self.bot.guilds:
+            if await self.bot.get_category(guild) is not None:
+                self.schedule_reconcile(guild)
+
+    async def cog_unload(self):
+        self.flush_voice_log.cancel()
+        await self.voice_log.flush()
+
+    @loop(seconds=60)
+    async def flush_voice_log(self):
+        """Writes buffered voice sessions to the database."""
+        await self.voice_log.flush()
          
     @Cog.listener()
     async def on_resumed(self):
-        # Creates a list of all members currently in a voice channel
-        current_member_ids: list[int] = []
-        for guild in self.bot.guilds:
-            for voice_channel in guild.voice_channels:
-                for member in voice_channel.members:
-                    current_member_ids.append(member.id)
-
-        # Deletes all members from the dict who are no longer connected
-        ids_to_delete = [
-            member_id for member_id in self.id_time_dict 
-            if member_id not in current_member_ids]
-        for id in ids_to_delete:
-            del self.id_time_dict[id]
-
-        # Adds all members to the dict who need to be added
-        ids_to_add = [
-            member_id for member_id in current_member_ids
-            if member_id not in self.id_time_dict]
-        for id in ids_to_add:
-            self.id_time_dict[id] = datetime.datetime.now()
+        self.voice_log.reconcile()
+        if self.voice_log.full:
+            await self.voice_log.flush()
 
     @Cog.listener()
     async def on_voice_state_update(
             self, member: discord.Member, 
-            _, after: discord.VoiceState):
+            before: discord.VoiceState, after: discord.VoiceState):
         
+        key = (member.guild.id, member.id)
+
         # Member joins a voice channel
-        if after.channel and member.id not in self.id_time_dict:
-            self.id_time_dict[member.id] = datetime.datetime.now()
+        if after.channel and key not in self.voice_log.join_times:
+            self.voice_log.start_session(*key, datetime.datetime.now())
             
         # Member leaves voice
-        if not after.channel and member.id in self.id_time_dict:
-            del self.id_time_dict[member.id]
+        if not after.channel and key in self.voice_log.join_times:
+            self.voice_log.leave(*key)
 
-        # Get the empty channels for the guild's category
-        # If it doesn't exist, simply return.
+        if self.voice_log.full:
+            await self.voice_log.flush()
+
+        # Mutes, deafens and streams don't change the layout.
+        if before.channel == after.channel:
+            return
+
+        # Schedules a pass over the guild's voice category if the
+        # member moved in or out of it.
         category = await self.bot.get_category(member.guild)
         if not isinstance(category, discord.CategoryChannel):
             return
-        empty_channels = [c for c in category.voice_channels if not c.members]
-        
-        # Add an empty channel since all channels are full.
-        if not empty_channels:
-            await category.create_voice_channel(
-                f"voice {num2words(len(category.voice_channels) + 1)}")
-
-        # Delete an empty channel since 2 are empty.
-        if len(empty_channels) >= 2:
-            del_channel = empty_channels[-1]
-            await del_channel.delete()
-
-            # Rename and reorder leftover channels.
-            for i, channel in enumerate([
-                c for c in category.voice_channels
-                if c != del_channel]):
-                
-                await channel.edit(
-                    name=f"voice {num2words(i + 1)}",
-                    position=i)
+        if category.id in (
+                getattr(before.channel, "category_id", None),
+                getattr(after.channel, "category_id", None)):
+            reconciler = self.get_reconciler(member.guild)
+            # Refills straight away if the member took the last empty
+            # channel.
+            joined = getattr(after.channel, "category_id", None) == category.id
+            reconciler.schedule(immediate=joined and reconciler.is_full(category))
+
+    def get_reconciler(self, guild: discord.Guild) -> CategoryReconciler:
+        if guild.id not in self.reconcilers:
+            self.reconcilers[guild.id] = CategoryReconciler(self.bot, guild)
+        return self.reconcilers[guild.id]
+
+    def schedule_reconcile(self, guild: discord.Guild):
+        """Schedules a pass over the guild's voice category."""
+
+        self.get_reconciler(guild).schedule()
 
     
 async def setup(bot: toof.ToofBot):
@@ -1,12 +1,22 @@
 """Extension that sends a message and creates a thread when someone
 joins the server. They will have access to the thread but not the rest
-of the server.
+of the server. During a wave of joins, members are welcomed together in
+one message instead.
 """
 
+import asyncio
+from collections import deque
+import logging
+import time
+
 import discord
 from discord.ext.commands import Cog
 
 import toof
+from toof.concurrency import gather
+
+
+log = logging.getLogger(__name__)
 
 
 class WelcomeChannelConfig(discord.app_commands.Group):
@@ -27,6 +37,7 @@ class WelcomeChannelConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             "Welcome Channel disabled.", ephemeral=True)
@@ -41,29 +52,90 @@ class WelcomeChannelConfig(discord.app_commands.Group):
             WHERE guild_id = {interaction.guild_id}"""
         await self.bot.db.execute(query)
         await self.bot.db.commit()
+        self.bot.forget_guild_config(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Welcome Channel set to {interaction.channel.mention}",
             ephemeral=True)
 
 
-class WelcomeCommandGroup(discord.app_commands.Group):
+class WelcomeThreads(dict[int, int]):
+    """Maps the id of each open welcome thread to the id of the member
+    it was made for. Loaded from the threads table once at startup.
+    Removals are written through right away, and new threads are
+    written in batches by flush.
+    """
 
     def __init__(self, bot: toof.ToofBot):
+        super().__init__()
+        self.bot = bot
+        # Threads in the map that haven't been written yet.
+        self.pending: list[tuple[int, int]] = []
+
+    async def load(self):
+        """Fills the map from the database."""
+
+        query = "SELECT thread_id, user_id FROM threads"
+        async with self.bot.db.execute(query) as cursor:
+            self.update({row[0]: row[1] async for row in cursor})
+
+    def queue(self, thread_id: int, user_id: int):
+        """Adds the thread to the map right away, but waits for the
+        next flush to write it to the database.
+        """
+
+        self[thread_id] = user_id
+        self.pending.append((thread_id, user_id))
+
+    @property
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    async def flush(self):
+        """Writes every queued thread in one transaction."""
+
+        pending = self.pending
+        self.pending = []
+        if not pending:
+            return
+
+        await self.bot.db.executemany(
+            "INSERT OR REPLACE INTO threads VALUES (?, ?)",
+            pending)
+        await self.bot.db.commit()
+
+    async def remove(self, thread_id: int):
+        """Removes the thread from the map and the database."""
+        
+        self.pending = [p for p in self.pending if p[0] != thread_id]
+        query = f"""
+            DELETE FROM threads
+            WHERE thread_id = {thread_id}"""
+        await self.bot.db.execute(query)
+        await self.bot.db.commit()
+        self.pop(thread_id, None)
+
+
+class WelcomeCommandGroup(discord.app_commands.Group):
+
+    def __init__(self, bot: toof.ToofBot, threads: WelcomeThreads):
         super().__init__(
             name="welcome",
             description="Commands relating to welcome threads.",
             guild_only=True)
         self.bot = bot
+        self.threads = threads
 
     @discord.app_commands.command(
         name="approve",
-        description="Approve the user..")
+        description="Approve the user..",
+        extras={"defer_ephemeral": False})
     async def approve_command(self, interaction: discord.Interaction):
         """Adds the member role to the user and locks the guild."""
 
-        member = await self.get_thread_member(interaction.channel)
-        role = await self.bot.get_member_role(interaction.guild)
+        member, role = (result.value for result in await gather(
+            self.get_thread_member(interaction.channel),
+            self.bot.get_member_role(interaction.guild)))
 
         if member is None:
             await interaction.response.send_message(
@@ -76,15 +148,27 @@ class WelcomeCommandGroup(discord.app_commands.Group):
                 ephemeral=True)
             return
         
+        # The thread is only closed once the member has the role, so a
+        # failed approval can be retried.
+        try:
+            await member.add_roles(role)
+        except discord.HTTPException as error:
+            log.warning("Couldn't approve %s: %r", member, error)
+            await interaction.response.send_message(
+                f"culdnt give {member.mention} the member role :( try again?",
+                ephemeral=True)
+            return
+
         await interaction.response.send_message(
             f"{member.mention} haz been accepted 😎")
-        await member.add_roles(role)
-        await interaction.channel.edit(archived=True, locked=True)
-        await self.remove_thread(interaction.channel)
+        await gather(
+            interaction.channel.edit(archived=True, locked=True),
+            self.remove_thread(interaction.channel))
 
     @discord.app_commands.command(
         name="deny",
-        description="Deny this user.")
+        description="Deny this user.",
+        extras={"defer_ephemeral": False})
     async def deny_command(self, interaction: discord.Interaction):
         
         member = await self.get_thread_member(interaction.channel)
@@ -95,52 +179,123 @@ class WelcomeCommandGroup(discord.app_commands.Group):
                 ephemeral=True)
             return
 
+        try:
+            await member.kick()
+        except discord.HTTPException as error:
+            log.warning("Couldn't deny %s: %r", member, error)
+            await interaction.response.send_message(
+                f"culdnt kick {member} :( try again?",
+                ephemeral=True)
+            return
+
         await interaction.response.send_message(
             f"{member} haz been rejected 👢")
-        await member.kick()
-        await interaction.channel.edit(archived=True, locked=True)
-        await self.remove_thread(interaction.channel)
+        await gather(
+            interaction.channel.edit(archived=True, locked=True),
+            self.remove_thread(interaction.channel))
 
     async def get_thread_member(self, thread: discord.Thread):
-        """Get the member that the thread maps to by searching the
-        database.
+        """Get the member that the thread maps to, fetching them if
+        they aren't cached.
         """
 
-        query = f"""
-            SELECT user_id
-            FROM threads
-            WHERE thread_id = {thread.id}"""
-        async with self.bot.db.execute(query) as cursor:
-            row = await cursor.fetchone()
-        if row is None:
+        user_id = self.threads.get(thread.id)
+        if user_id is None:
             return None
         
-        return discord.utils.find(
-            lambda m: m.id == row[0],
-            thread.guild.members)
+        member = thread.guild.get_member(user_id)
+        if member is None:
+            try:
+                member = await thread.guild.fetch_member(user_id)
+            except discord.NotFound:
+                return None
+        return member
 
     async def remove_thread(self, thread: discord.Thread):
         """Remove the thread from the database."""
-        
-        query = f"""
-            DELETE FROM threads
-            WHERE thread_id = {thread.id}"""
-        await self.bot.db.execute(query)
-        await self.bot.db.commit()
+        await self.threads.remove(thread.id)
 
 
-class WelcomeCog(Cog):
+class WelcomeQueue:
+    """Welcomes members who join from a queue per guild instead of
+    inside the gateway event. Each guild's queue is drained by one
+    worker, since its threads and messages all share the welcome
+    channel's rate limit, and at most `workers` guilds are drained at
+    once. New threads are written to the database in batches.
 
-    def __init__(self, bot: toof.ToofBot):
-        bot.tree.add_command(WelcomeCommandGroup(bot))
+    If more than `raid_threshold` members join a guild within
+    `raid_window` seconds, queued members are welcomed together in a
+    single message instead of getting a thread each.
+    """
+
+    def __init__(
+            self, bot: toof.ToofBot, threads: WelcomeThreads,
+            workers: int = 4, batch_size: int = 20,
+            raid_threshold: int = 10, raid_window: float = 60.0):
         self.bot = bot
+        self.threads = threads
+        self.semaphore = asyncio.Semaphore(workers)
+        self.batch_size = batch_size
+        self.raid_threshold = raid_threshold
+        self.raid_window = raid_window
 
-    @Cog.listener()
-    async def on_member_join(self, member: discord.Member):
-        """Creates a new thread whenever a member joins the guild."""
+        self.queues: dict[int, asyncio.Queue[discord.Member]] = {}
+        self.tasks: dict[int, asyncio.Task] = {}
+        self.joins: dict[int, deque[float]] = {}
+
+    def put(self, member: discord.Member):
+        """Queues the member to be welcomed."""
+
+        guild_id = member.guild.id
+        self.joins.setdefault(guild_id, deque()).append(time.monotonic())
+        self.queues.setdefault(guild_id, asyncio.Queue()).put_nowait(member)
+
+        task = self.tasks.get(guild_id)
+        if task is None or task.done():
+            self.tasks[guild_id] = asyncio.create_task(self.drain(guild_id))
+
+    def is_raid(self, guild_id: int) -> bool:
+        """Whether the guild's recent join rate is over the threshold."""
+
+        joins = self.joins[guild_id]
+        cutoff = time.monotonic() - self.raid_window
+        while joins and joins[0] < cutoff:
+            joins.popleft()
+        return len(joins) > self.raid_threshold
+
+    async def drain(self, guild_id: int):
+        """Welcomes everyone in the guild's queue."""
+
+        queue = self.queues[guild_id]
+        while True:
+            if queue.empty():
+                await self.threads.flush()
+                # Members put while flushing saw this task still running,
+                # so they're picked up here.
+                if queue.empty():
+                    break
+            async with self.semaphore:
+                members = [queue.get_nowait()]
+                if self.is_raid(guild_id):
+                    while not queue.empty() and len(members) < 50:
+                        members.append(queue.get_nowait())
+                try:
+                    if len(members) > 1:
+                        await self.welcome_many(members)
+                    else:
+                        await self.welcome(members[0])
+                except discord.HTTPException as error:
+                    log.warning("Couldn't welcome %s: %r", members, error)
+
+            if self.threads.pending_count >= self.batch_size:
+                await self.threads.flush()
+
+    async def welcome(self, member: discord.Member):
+        """Creates a welcome thread for the member."""
         
-        mod_role = await self.bot.get_mod_role(member.guild)
-        welcome_channel = await self.bot.get_welcome_channel(member.guild)
+        mod_role, welcome_channel = (result.value for result in await gather(
+            self.bot.get_mod_role(member.guild),
+            self.bot.get_welcome_channel(member.guild)))
 
         if welcome_channel is None or mod_role is None:
             return
@@ -157,13 +312,43 @@ class WelcomeCog(Cog):
             welcome_thread = await welcome_message.create_thread(
                 name=f"{member}'s welcome thread")
 
-        query = f"""
-            INSERT INTO threads
-            VALUES (
-                {welcome_thread.id},
-                {member.id})"""
-        await self.bot.db.execute(query)
-        await self.bot.db.commit()
+        self.threads.queue(welcome_thread.id, member.id)
+
+    async def welcome_many(self, members: list[discord.Member]):
+        """Welcomes all the members in one message without threads."""
+
+        guild = members[0].guild
+        mod_role, welcome_channel = (result.value for result in await gather(
+            self.bot.get_mod_role(guild),
+            self.bot.get_welcome_channel(guild)))
+
+        if welcome_channel is None or mod_role is None:
+            return
+
+        mentions = " ".join(member.mention for member in members)
+        await welcome_channel.send(
+            f"welcum {mentions} to {guild.name}! lotz of ppl r joining rn so a {mod_role.mention} wil let u in soon 👍",
+            allowed_mentions=discord.AllowedMentions(users=True, roles=False))
+
+
+class WelcomeCog(Cog):
+
+    def __init__(self, bot: toof.ToofBot):
+        self.threads = WelcomeThreads(bot)
+        self.queue = WelcomeQueue(bot, self.threads)
+        bot.tree.add_command(WelcomeCommandGroup(bot, self.threads))
+        self.bot = bot
+
+    async def cog_load(self):
+        await self.threads.load()
+
+    async def cog_unload(self):
+        await self.threads.flush()
+
+    @Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        """Queues the member to get a welcome thread."""
+        self.queue.put(member)
 
 
 async def setup(bot: toof.ToofBot):
@@ -0,0 +1,105 @@
+"""Helpers for running several Discord calls at once instead of
+awaiting them one after another.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+from typing import Any, Awaitable
+
+import discord
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CallResult:
+    """The outcome of a single awaitable run by gather."""
+
+    value: Any = None
+    error: Exception | None = None
+    latency: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def gather(*aws: Awaitable) -> list[CallResult]:
+    """Runs the awaitables concurrently and returns a CallResult for
+    each, in order. An exception in one is logged and kept in its result
+    instead of cancelling the others or propagating.
+    """
+
+    async def run(aw: Awaitable) -> CallResult:
+        result = CallResult()
+        start = time.perf_counter()
+        try:
+            result.value = await aw
+        except Exception as error:
+            result.error = error
+            log.warning("%r failed: %r", aw, error)
+        result.latency = time.perf_counter() - start
+        return result
+
+    return await asyncio.gather(*[run(aw) for aw in aws])
+
+
+@dataclass
+class SendResult:
+    """The outcome of sending a single payload to a single target."""
+
+    target: discord.abc.Messageable
+    message: discord.Message | None = None
+    error: Exception | None = None
+    latency: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def broadcast(
+        targets: list[tuple[discord.abc.Messageable, str | dict]],
+        limit: int = 5) -> list[SendResult]:
+    """Sends each payload to its target with at most `limit` sends in
+    flight at once. A payload is either the message content or a dict
+    of keyword arguments for `send`. Returns a SendResult for every
+    target, in the order they were given.
+
+    Messages to the same channel share a rate limit bucket, so sends to
+    one channel wait on each other instead of racing into a 429.
+    """
+
+    semaphore = asyncio.Semaphore(limit)
+    buckets: dict[int, asyncio.Lock] = {}
+
+    async def send(target, payload) -> SendResult:
+        result = SendResult(target)
+        kwargs = payload if isinstance(payload, dict) else {"content": payload}
+        bucket = buckets.setdefault(getattr(target, "id", id(target)), asyncio.Lock())
+
+        async with bucket, semaphore:
+            start = time.perf_counter()
+            try:
+                result.message = await target.send(**kwargs)
+            except (AttributeError, discord.HTTPException) as error:
+                # Either the target wasn't a channel or it couldn't be
+                # sent to.
+                result.error = error
+            result.latency = time.perf_counter() - start
+
+        return result
+
+    results = await asyncio.gather(
+        *[send(target, payload) for target, payload in targets])
+
+    for result in results:
+        if not result.ok:
+            log.warning(
+                "Broadcast to %s failed after %.0fms: %r",
+                result.target, result.latency * 1000, result.error)
+
+    return results
@@ -0,0 +1,147 @@
+"""Defers interactions automatically when their handler is slow to
+respond, so users don't see "This interaction failed" under load.
+
+App commands are covered by ToofTree. Component callbacks opt in with
+the auto_defer decorator. Commands can set "defer_ephemeral" (default
+True) and "auto_defer" (default True, turn off for commands that send
+modals) in their extras.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import functools
+import logging
+
+import discord
+
+
+log = logging.getLogger(__name__)
+
+# Holds the auto defer tasks until they finish, since the loop only
+# keeps weak references to them.
+pending_defers: set[asyncio.Task] = set()
+
+
+class AutoDeferResponse(discord.InteractionResponse):
+    """An InteractionResponse that can defer itself. Once it has,
+    send_message and edit_message go through followups and edits of the
+    original response instead, so handlers don't need to know.
+    """
+
+    def __init__(
+            self, parent: discord.Interaction,
+            ephemeral: bool, name: str):
+        super().__init__(parent)
+        self.ephemeral = ephemeral
+        self.name = name
+        self.auto_deferred = False
+        self.lock = asyncio.Lock()
+
+    async def auto_defer(self):
+        """Defers the interaction if nothing has responded yet."""
+
+        async with self.lock:
+            if self.is_done():
+                return
+            try:
+                if self._parent.type == discord.InteractionType.component:
+                    await super().defer()
+                else:
+                    await super().defer(ephemeral=self.ephemeral, thinking=True)
+            except discord.HTTPException as error:
+                log.warning("Couldn't auto defer %s: %r", self.name, error)
+                return
+            self.auto_deferred = True
+
+        self._parent.client.metrics.count("auto_defer", self.name)
+
+    async def defer(self, **kwargs):
+        async with self.lock:
+            if not self.auto_deferred:
+                return await super().defer(**kwargs)
+
+    async def send_message(self, content=None, **kwargs):
+        async with self.lock:
+            if not self.auto_deferred:
+                return await super().send_message(content, **kwargs)
+
+        kwargs.pop("delete_after", None)
+        return await self._parent.followup.send(content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        async with self.lock:
+            if not self.auto_deferred:
+                return await super().edit_message(**kwargs)
+
+        kwargs.pop("delete_after", None)
+        kwargs.pop("suppress_embeds", None)
+        return await self._parent.edit_original_response(**kwargs)
+
+
+@asynccontextmanager
+async def deferring(
+        interaction: discord.Interaction, name: str,
+        ephemeral: bool = True, budget: float = None):
+    """Defers the interaction if the body hasn't responded within the
+    budget, which defaults to the bot's defer_budget.
+    """
+
+    if budget is None:
+        budget = interaction.client.defer_budget
+
+    response = interaction.client.defer_response_cls(interaction, ephemeral, name)
+    interaction._cs_response = response
+
+    def start_defer():
+        task = loop.create_task(response.auto_defer())
+        pending_defers.add(task)
+        task.add_done_callback(pending_defers.discard)
+
+    loop = asyncio.get_running_loop()
+    handle = loop.call_later(budget, start_defer)
+    try:
+        yield response
+    finally:
+        handle.cancel()
+
+
+def auto_defer(ephemeral: bool = True, budget: float = None):
+    """Decorator for component callbacks that defers the interaction
+    if the callback is slow to respond.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, interaction: discord.Interaction, *args):
+            name = func.__qualname__
+            with interaction.client.metrics.timer("component", name):
+                async with deferring(
+                        interaction, name,
+                        ephemeral=ephemeral, budget=budget):
+                    return await func(self, interaction, *args)
+        return wrapper
+    return decorator
+
+
+class ToofTree(discord.app_commands.CommandTree):
+    """CommandTree that times app commands and defers the ones whose
+    callbacks are slow to respond.
+    """
+
+    async def _call(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.application_command:
+            return await super()._call(interaction)
+
+        command = interaction.command
+        if command is None:
+            return await super()._call(interaction)
+
+        extras = command.extras
+        with self.client.metrics.timer("command", command.qualified_name):
+            if not extras.get("auto_defer", True):
+                return await super()._call(interaction)
+
+            async with deferring(
+                    interaction, command.qualified_name,
+                    ephemeral=extras.get("defer_ephemeral", True)):
+                await super()._call(interaction)
@@ -0,0 +1,264 @@
+"""Latency histograms and counters for commands, events, database
+queries and HTTP requests, kept on the bot as bot.metrics. They can
+also be served in Prometheus' text format by MetricsServer.
+"""
+
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+import logging
+import re
+import time
+
+from aiohttp import web
+import aiosqlite
+
+
+log = logging.getLogger(__name__)
+
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts observations into fixed latency buckets."""
+
+    def __init__(self):
+        # The last bucket catches everything over the largest bound.
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Estimates the quantile as the upper bound of the bucket it
+        falls in.
+        """
+
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([*map(str, BUCKETS), "inf"], self.buckets))}
+
+
+class Metrics:
+    """Histograms and counters grouped by kind ("command", "event",
+    "db", "http", ...) and then by label.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms: defaultdict[str, defaultdict[str, Histogram]] = \
+            defaultdict(lambda: defaultdict(Histogram))
+        self.counters: defaultdict[str, Counter[str]] = defaultdict(Counter)
+
+    def observe(self, kind: str, label: str, seconds: float):
+        self.histograms[kind][label].observe(seconds)
+
+    def count(self, kind: str, label: str, amount: int = 1):
+        self.counters[kind][label] += amount
+
+    @contextmanager
+    def timer(self, kind: str, label: str):
+        """Times the body and observes it, even if it raises."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, label, time.perf_counter() - start)
+
+    def top(self, kind: str, n: int = 5) -> list[tuple[str, Histogram]]:
+        """Returns the n labels of the kind with the most total time."""
+
+        return sorted(
+            self.histograms[kind].items(),
+            key=lambda item: item[1].sum,
+            reverse=True)[:n]
+
+    def to_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "uptime": time.time() - self.started,
+            "histograms": {
+                kind: {
+                    label: histogram.to_dict()
+                    for label, histogram in histograms.items()}
+                for kind, histograms in self.histograms.items()},
+            "counters": {
+                kind: dict(counter)
+                for kind, counter in self.counters.items()}}
+
+
+@lru_cache(maxsize=1024)
+def query_label(sql: str) -> str:
+    """Labels a query by its verb and table, like "SELECT pics"."""
+
+    verb = sql.split(None, 1)[0].upper() if sql.strip() else "?"
+    match = re.search(
+        r"\b(?:FROM|INTO|UPDATE|(?:TABLE|INDEX)(?: IF NOT EXISTS)?)\s+(\w+)",
+        sql, re.IGNORECASE)
+    return f"{verb} {match[1]}" if match else verb
+
+
+class TimedQuery:
+    """Stands in for the result of aiosqlite's execute, so a query can
+    still be awaited or used with async with, and times it.
+    """
+
+    def __init__(self, metrics: Metrics, label: str, coro):
+        self.metrics = metrics
+        self.label = label
+        self.coro = coro
+        self.cursor: aiosqlite.Cursor = None
+
+    async def run(self) -> aiosqlite.Cursor:
+        with self.metrics.timer("db", self.label):
+            return await self.coro
+
+    def __await__(self):
+        return self.run().__await__()
+
+    async def __aenter__(self) -> aiosqlite.Cursor:
+        self.cursor = await self.run()
+        return self.cursor
+
+    async def __aexit__(self, *exc_info):
+        await self.cursor.close()
+
+
+class TimedConnection:
+    """Wraps an aiosqlite connection to time every query. Anything
+    that isn't a query is passed through to the connection.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, metrics: Metrics):
+        self.db = db
+        self.metrics = metrics
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def execute(self, sql: str, parameters=None) -> TimedQuery:
+        return TimedQuery(
+            self.metrics, query_label(sql), self.db.execute(sql, parameters))
+
+    def executemany(self, sql: str, parameters) -> TimedQuery:
+        return TimedQuery(
+            self.metrics, query_label(sql), self.db.executemany(sql, parameters))
+
+    async def commit(self):
+        with self.metrics.timer("db", "COMMIT"):
+            await self.db.commit()
+
+
+def instrument_http(http, metrics: Metrics):
+    """Times every request the bot's HTTPClient makes, labelled by
+    method and route, like "POST /channels/{channel_id}/messages".
+    """
+
+    request = http.request
+
+    async def timed_request(route, *args, **kwargs):
+        with metrics.timer("http", f"{route.method} {route.path}"):
+            return await request(route, *args, **kwargs)
+
+    http.request = timed_request
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsServer:
+    """Serves the bot's metrics at /metrics in Prometheus' text format.
+    Started by the bot when TOOFMETRICSPORT is set, and only bound to
+    localhost unless TOOFMETRICSHOST says otherwise.
+    """
+
+    def __init__(self, bot, port: int, host: str = "127.0.0.1"):
+        self.bot = bot
+        self.port = port
+        self.host = host
+        self.runner: web.AppRunner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        log.info("Serving metrics on %s:%d.", self.host, self.port)
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.render(),
+            content_type="text/plain",
+            charset="utf-8")
+
+    def render(self) -> str:
+        """Renders every metric in one pass, without copying them."""
+
+        metrics = self.bot.metrics
+        lines = []
+
+        for kind, histograms in metrics.histograms.items():
+            name = f"toof_{kind}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for label, histogram in histograms.items():
+                label = escape_label(label)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(
+                    f'{name}_bucket{{name="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{name="{label}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{name="{label}"}} {histogram.count}')
+
+        for kind, counter in metrics.counters.items():
+            name = f"toof_{kind}_total"
+            lines.append(f"# TYPE {name} counter")
+            for label, count in counter.items():
+                lines.append(f'{name}{{name="{escape_label(label)}"}} {count}')
+
+        gauges = {
+            "toof_gateway_latency_seconds": self.bot.latency,
+            "toof_loop_lag_seconds": self.bot.watchdog.lag,
+            "toof_guilds": len(self.bot.guilds),
+            "toof_members": sum(
+                guild.member_count or 0 for guild in self.bot.guilds),
+            "toof_uptime_seconds": time.time() - metrics.started}
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        lines.append("")
+        return "\n".join(lines)
@@ -5,10 +5,15 @@ to Discord bot functionality (i.e. dataclasses).
 from dataclasses import dataclass
 from datetime import datetime
 import random
+from typing import Awaitable, Callable
 
 import discord
 
 
+# How many pics a Collection loads at once.
+PAGE_SIZE = 10
+
+
 class PicRarity:
     """Class representing different ToofPic rarities."""
 
@@ -182,24 +187,163 @@ class ToofPics(list[ToofPic]):
             # No pics for the chosen rarity. Remove and try again.
             except IndexError:
                 rarities.remove(rarity)
+
+    def get_random_many(self, count: int) -> list[ToofPic]:
+        """Selects count random ToofPics, weighted by rarity the same
+        way as get_random, grouping the list by rarity only once.
+        Raises IndexError if the list is empty.
+        """
+
+        # Keyed by name, since PicRarity isn't hashable.
+        groups: dict[str, list[ToofPic]] = {}
+        for pic in self:
+            groups.setdefault(pic.rarity.name, []).append(pic)
+        if not groups:
+            raise IndexError("cannot choose from an empty list")
+
+        names = list(groups)
+        chosen = random.choices(
+            population=names,
+            weights=[PicRarity.get(name).weight for name in names],
+            k=count)
+        return [random.choice(groups[name]) for name in chosen]
                 
+
+
+def ordinal(pic_id: str) -> int:
+    """Returns the pic's position in the catalog, from its id. "C004"
+    is the fourth pic added, so its ordinal is 3.
+    """
+    return int(pic_id[1:]) - 1
+
+
+class Ownership:
+    """The pics a user owns as a bitset, where bit n is set if they own
+    the pic with ordinal n. Stored as a little-endian BLOB.
+    """
+
+    def __init__(self, bits: int = 0):
+        self.bits = bits
+
+    @classmethod
+    def from_bytes(cls, blob: bytes | None):
+        return cls(int.from_bytes(blob or b"", "little"))
+
+    @classmethod
+    def from_ids(cls, pic_ids):
+        bits = 0
+        for pic_id in pic_ids:
+            bits |= 1 << ordinal(pic_id)
+        return cls(bits)
+
+    def to_bytes(self) -> bytes:
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+
+    def add(self, pic_id: str):
+        self.bits |= 1 << ordinal(pic_id)
+
+    def remove(self, pic_id: str):
+        self.bits &= ~(1 << ordinal(pic_id))
+
+    def count(self, mask: int = -1) -> int:
+        """Returns how many pics are owned out of those in the mask."""
+        return (self.bits & mask).bit_count()
+
+    def missing(self, mask: int) -> int:
+        """Returns the bits of the pics in the mask that aren't owned."""
+        return mask & ~self.bits
+
+    def nth(self, mask: int, n: int) -> int:
+        """Returns the ordinal of the nth owned pic in the mask, counting
+        from 0 in order of ordinal. Raises IndexError if there aren't
+        that many.
+        """
+
+        bits = self.bits & mask
+        for _ in range(n):
+            # Clears the lowest set bit.
+            bits &= bits - 1
+        if not bits:
+            raise IndexError("not enough owned pics in the mask")
+        return (bits & -bits).bit_length() - 1
+
+    def __contains__(self, pic: "str | ToofPic") -> bool:
+        pic_id = pic if isinstance(pic, str) else pic.id
+        return bool(self.bits >> ordinal(pic_id) & 1)
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+
+def catalog_masks(all_pics: ToofPics) -> dict[str, int]:
+    """Returns a mask of the catalog's ordinals for each rarity, and
+    one for the whole catalog under "overview".
+    """
+
+    masks = {rarity.name: 0 for rarity in [PicRarity.overview] + PicRarity.list()}
+    for pic in all_pics:
+        bit = 1 << ordinal(pic.id)
+        masks[pic.rarity.name] = masks.get(pic.rarity.name, 0) | bit
+        masks["overview"] |= bit
+    return masks
+
+
+def overview_counts(
+        ownership: Ownership,
+        masks: dict[str, int]) -> dict[str, tuple[int, int]]:
+    """Returns how many pics are owned and how many there are in total
+    for each rarity, and for the whole catalog under "overview".
+    """
+
+    return {
+        name: (ownership.count(mask), mask.bit_count())
+        for name, mask in masks.items()}
+
     
 class Collection:
-    """Object representing a user's collection of ToofPics."""
+    """Object representing a user's collection of ToofPics. The overview
+    is built from the ownership bitset alone. Pics are loaded by
+    `loader` a page of PAGE_SIZE at a time, only once the menu reaches
+    that page, and the pages visited are kept.
+    """
 
     def __init__(
-            self, usr_pics: ToofPics, all_pics: ToofPics = ToofPics(),
-            user: discord.User = None):
-        self.__overview = self.__get_overview_embed(usr_pics, all_pics, user)
+            self, ownership: Ownership, masks: dict[str, int],
+            user: discord.User = None,
+            loader: Callable[[PicRarity, int | None, int], Awaitable[list[ToofPic]]] = None):
+        self.user = user
+        self.ownership = ownership
+        self.masks = masks
+        self.counts = overview_counts(ownership, masks)
+        self.loader = loader
+        self.__overview = self.__get_overview_embed(self.counts, user)
         self.__index = 0
         self.__page = PicRarity.overview
-        self.cur_pics = []
-        self.pics = usr_pics
+        self.pages: dict[tuple[str, int], list[ToofPic]] = {}
+
+    @property
+    def num_owned(self) -> int:
+        """How many pics the user owns in total."""
+        return self.counts.get("overview", (0, 0))[0]
+
+    @property
+    def cur_count(self) -> int:
+        """How many pics can be paged through on the current page."""
+        if self.page == PicRarity.overview:
+            return 0
+        return self.counts.get(self.page.name, (0, 0))[0]
+
+    @property
+    def cur_pic(self) -> ToofPic | None:
+        """The current pic, if its page has been loaded."""
+        page = self.pages.get((self.page.name, self.index // PAGE_SIZE), [])
+        offset = self.index % PAGE_SIZE
+        return page[offset] if offset < len(page) else None
 
     @property
     def cur_content(self) -> str | None:
         """The current content for the menu."""
-        if self.page == PicRarity.overview or self.cur_pics:
+        if self.page == PicRarity.overview or self.cur_count:
             return None
         return f"You don't have any {self.page} ToofPics!"
         
@@ -208,8 +352,8 @@ class Collection:
         """The current embed of the menu."""
         if self.page == PicRarity.overview:
             return self.__overview
-        if self.cur_pics:
-            return self.cur_pics[self.index].embed
+        if self.cur_pic is not None:
+            return self.cur_pic.embed
         return None
 
     @property
@@ -217,9 +361,10 @@ class Collection:
         """The current page of the menu."""
         return self.__page
 
-    @page.setter
-    def page(self, new_page: str | PicRarity):
-        """Sets the page and handles changing other attributes."""
+    async def set_page(self, new_page: str | PicRarity, load: bool = True):
+        """Sets the page and loads its first pics, unless load is False
+        because set_index is about to load the page it lands on.
+        """
         if isinstance(new_page, str):
             new_page = PicRarity.get(new_page)
         elif not isinstance(new_page, PicRarity):
@@ -227,35 +372,59 @@ class Collection:
         if new_page != self.page:
             self.__index = 0
             self.__page = new_page
-            self.cur_pics = self.pics[new_page]
+            if load:
+                await self.load()
 
     @property
     def index(self):
         """The index of the current pic on the menu."""
         return self.__index
 
-    @index.setter
-    def index(self, new_index: int):
-        """Changes the index of the current pic."""
+    async def set_index(self, new_index: int):
+        """Changes the index of the current pic, loading its page if it
+        hasn't been yet.
+        """
         try:
-            self.__index = new_index % len(self.cur_pics)
+            self.__index = new_index % self.cur_count
         except ZeroDivisionError:
             self.__index = 0
+        await self.load()
+
+    async def load(self):
+        """Loads the page of pics the current index is on. The page
+        starts after the ordinal of the pic just before it, which is
+        found from the ownership bitset, so any page can be loaded with
+        one keyset query no matter which pages have been visited.
+        """
+
+        number = self.index // PAGE_SIZE
+        key = (self.page.name, number)
+        if (self.page == PicRarity.overview or not self.cur_count
+                or key in self.pages or self.loader is None):
+            return
+
+        after = None
+        if number:
+            after = self.ownership.nth(
+                self.masks[self.page.name], number * PAGE_SIZE - 1)
+        self.pages[key] = await self.loader(self.page, after, PAGE_SIZE)
 
     @staticmethod
     def __get_overview_embed(
-        usr_pics: ToofPics, all_pics: ToofPics,
+        counts: dict[str, tuple[int, int]],
         user: discord.User) -> discord.Embed | None:
-        """Return an embed summarizing the collection. Returns none if the
-        user has no pictures.
+        """Return an embed summarizing the collection from the owned
+        and total counts of each rarity. Returns none if there are no
+        pics at all.
         """
         
-        if not all_pics or user is None:
+        num_usr, num_all = counts.get("overview", (0, 0))
+        if not num_all or user is None:
             return None
 
         embed = discord.Embed(
             color=(
-                discord.Color.gold() if len(usr_pics) == len(all_pics)
+                discord.Color.gold() if num_usr == num_all
                 else discord.Color.blurple()),
             description="")
         embed.set_author(
@@ -263,13 +432,10 @@ class Collection:
             icon_url=user.avatar.url)
 
         for rarity in PicRarity.list() + [PicRarity.overview]:
+            num_usr, num_all = counts.get(rarity.name, (0, 0))
             if rarity == PicRarity.overview:
-                num_usr = len(usr_pics)
-                num_all = len(all_pics)
                 embed.description += f"\n**TOTAL:** {num_usr} of {num_all} pics "
             else:
-                num_usr = len(usr_pics[rarity])
-                num_all = len(all_pics[rarity])
                 embed.description += f"{rarity.emoji} {num_usr} of {num_all} {rarity} pics "
             try:
                 percent = num_usr / num_all * 100
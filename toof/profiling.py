@@ -0,0 +1,107 @@
+"""Tools for profiling the bot while it's running: a sampling profiler
+that produces collapsed stacks for flamegraphs, and tracemalloc
+snapshots of where memory is being allocated.
+"""
+
+import asyncio
+from collections import Counter
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def collapse(frame) -> str:
+    """Turns a frame and its callers into a collapsed stack, from the
+    outermost call to the innermost, like "main;run;handler".
+    """
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread every interval from another
+    thread, so the profiled code doesn't pay for tracing every call.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+
+    def run(self, seconds: float):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """Returns the samples in the collapsed stack format read by
+        flamegraph.pl and speedscope.
+        """
+
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def top(self, n: int = 25) -> str:
+        """Returns a table of the functions that were running in the
+        most samples.
+        """
+
+        own = Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+
+        total = sum(own.values()) or 1
+        return "\n".join(
+            f"{count / total:6.1%} {count:>6} {name}"
+            for name, count in own.most_common(n))
+
+
+async def profile_cpu(seconds: float, interval: float = 0.005) -> SamplingProfiler:
+    """Samples the event loop's thread for the given number of seconds."""
+
+    profiler = SamplingProfiler(threading.get_ident(), interval)
+    await asyncio.to_thread(profiler.run, seconds)
+    return profiler
+
+
+async def profile_memory(seconds: float, limit: int = 25, frames: int = 10) -> str:
+    """Traces allocations for the given number of seconds and returns a
+    table of the lines that allocated the most, and of the largest
+    allocations still held overall.
+    """
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+
+    lines = [f"allocated during the last {seconds}s:"]
+    lines += [str(stat) for stat in after.compare_to(before, "lineno")[:limit]]
+    lines += ["", "largest held overall:"]
+    lines += [str(stat) for stat in after.statistics("lineno")[:limit]]
+    lines += ["", "largest held overall, by traceback:"]
+    for stat in after.statistics("traceback")[:5]:
+        lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+        lines += stat.traceback.format()
+    return "\n".join(lines)
@@ -0,0 +1,120 @@
+"""Records the gateway events the bot receives to a gzipped file of
+JSON lines, so real traffic can be replayed later by the benchmarks in
+toof.bench. Turned on by setting TOOFRECORD to the file to write.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import time
+import zlib
+
+
+log = logging.getLogger(__name__)
+
+
+# Events that build up the state the traffic events refer to.
+STATE_EVENTS = {
+    "READY", "GUILD_CREATE", "GUILD_DELETE", "GUILD_UPDATE",
+    "GUILD_MEMBERS_CHUNK", "GUILD_MEMBER_ADD", "GUILD_MEMBER_REMOVE",
+    "GUILD_MEMBER_UPDATE", "GUILD_ROLE_CREATE", "GUILD_ROLE_DELETE",
+    "GUILD_ROLE_UPDATE", "CHANNEL_CREATE", "CHANNEL_DELETE",
+    "CHANNEL_UPDATE", "THREAD_CREATE", "THREAD_DELETE"}
+
+# The events whose handlers are worth benchmarking.
+TRAFFIC_EVENTS = {
+    "MESSAGE_CREATE", "MESSAGE_DELETE", "MESSAGE_UPDATE",
+    "PRESENCE_UPDATE", "VOICE_STATE_UPDATE",
+    "MESSAGE_REACTION_ADD", "MESSAGE_REACTION_REMOVE"}
+
+
+class GatewayRecorder:
+    """Wraps the parsers of a ConnectionState so every state and
+    traffic event is written out, one {"t", "s", "d"} object per line,
+    before it's parsed.
+
+    Every `flush_interval` seconds the compressor is sync flushed, so a
+    crash only loses the events since the last flush and the file can
+    still be read up to there.
+    """
+
+    def __init__(
+            self, path: str, events: set[str] = STATE_EVENTS | TRAFFIC_EVENTS,
+            flush_interval: float = 5.0):
+        self.path = path
+        self.events = events
+        self.flush_interval = flush_interval
+        self.file = gzip.open(path, "ab")
+        self.count = 0
+        self.task: asyncio.Task = None
+
+    def start(self):
+        """Starts flushing the file every flush_interval seconds."""
+        self.task = asyncio.get_running_loop().create_task(self.flush_forever())
+
+    async def flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Writes out everything compressed so far as whole blocks."""
+        if not self.file.closed:
+            self.file.flush(zlib.Z_SYNC_FLUSH)
+
+    def install(self, connection):
+        """Wraps the connection's parsers in place, so the websocket
+        picks them up whenever it connects.
+        """
+
+        for event in self.events:
+            if event in connection.parsers:
+                connection.parsers[event] = self.wrap(event, connection.parsers[event])
+        log.info("Recording gateway events to %s.", self.path)
+
+    def wrap(self, event: str, parser):
+        def record(data):
+            self.write(event, data)
+            return parser(data)
+        return record
+
+    def write(self, event: str, data: dict):
+        line = json.dumps(
+            {"t": event, "s": time.time(), "d": data},
+            separators=(",", ":"))
+        self.file.write(line.encode("utf-8") + b"\n")
+        self.count += 1
+
+    def close(self):
+        """Stops flushing and closes the file. Safe to call twice."""
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.file.closed:
+            return
+        self.file.close()
+        log.info("Recorded %d gateway events to %s.", self.count, self.path)
+
+
+def read_events(path: str):
+    """Yields (event, timestamp, data) for each line of a recording.
+    A recording cut off by a crash is read up to its last whole line.
+    """
+
+    with gzip.open(path, "rb") as file:
+        while True:
+            try:
+                line = file.readline()
+            except (EOFError, zlib.error, gzip.BadGzipFile) as error:
+                log.warning("%s ends early, stopping there: %r", path, error)
+                return
+            if not line:
+                return
+            if not line.endswith(b"\n"):
+                log.warning("%s ends partway through a line.", path)
+                return
+            if line.strip():
+                record = json.loads(line)
+                yield record["t"], record["s"], record["d"]
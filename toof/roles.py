@@ -0,0 +1,81 @@
+"""Classes for the self-assignable role menus. The menus are built
+and cached by ToofBot, so every extension shares one copy.
+"""
+
+from dataclasses import dataclass
+
+import discord
+
+
+# Discord doesn't allow more options than this in a select menu.
+OPTIONS_PER_PAGE = 25
+
+DEFAULT_CATEGORIES = [("pings", "🔔"), ("gaming", "🎮"), ("pronouns", "😊")]
+
+
+@dataclass
+class ConfigRole:
+    """Class containing a discord role and information for the roles
+    menu.
+    """
+    
+    role: discord.Role
+    emoji: discord.PartialEmoji
+    description: str
+    type: str
+
+
+@dataclass
+class RoleCategory:
+    """A category of roles, shown as its own page of the roles menu."""
+
+    id: int
+    name: str
+    emoji: discord.PartialEmoji
+
+    @property
+    def label(self) -> str:
+        return self.name.title()
+
+
+class RoleMenu(list[ConfigRole]):
+    """A list of ConfigRoles for the given guild and the categories
+    they belong to. Each category's roles and select options are split
+    into pages that fit in a select menu. Built and cached per guild by
+    ToofBot.get_role_menu.
+    """
+
+    def __init__(
+            self, list: list[ConfigRole] = None,
+            categories: list[RoleCategory] = None):
+        super().__init__(list or [])
+        self.categories = categories or []
+        self.categories_by_id = {
+            category.id: category for category in self.categories}
+
+        by_category: dict[str, list[ConfigRole]] = {
+            category.name: [] for category in self.categories}
+        for conf_role in self:
+            if conf_role.type in by_category:
+                by_category[conf_role.type].append(conf_role)
+
+        self.pages: dict[str, list[list[ConfigRole]]] = {
+            name: [
+                conf_roles[i:i + OPTIONS_PER_PAGE]
+                for i in range(0, len(conf_roles), OPTIONS_PER_PAGE)]
+            for name, conf_roles in by_category.items()}
+
+        self.options: dict[str, list[list[discord.SelectOption]]] = {
+            name: [
+                [
+                    discord.SelectOption(
+                        label=conf_role.role.name,
+                        value=str(conf_role.role.id),
+                        description=conf_role.description,
+                        emoji=conf_role.emoji)
+                    for conf_role in page]
+                for page in pages]
+            for name, pages in self.pages.items()}
+
+    def get_category(self, name: str) -> RoleCategory | None:
+        return discord.utils.get(self.categories, name=name)
@@ -0,0 +1,125 @@
+"""Watches the event loop for lag. A heartbeat task measures how late
+the loop wakes up, and a thread captures the loop's stack whenever a
+heartbeat is overdue, so whatever is blocking the loop gets caught in
+the act.
+"""
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import logging
+import sys
+import threading
+import time
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Stall:
+    """A time the loop was blocked for longer than the threshold."""
+
+    time: float
+    lag: float
+    task: str
+    stack: str
+
+
+class LoopWatchdog:
+    """Measures event loop lag every interval and keeps a rolling
+    history of it, along with the stacks of recent stalls. In debug
+    mode, asyncio also logs every callback slower than the threshold.
+    """
+
+    def __init__(
+            self, metrics, interval: float = 1.0,
+            threshold: float = 0.5, history: int = 3600,
+            debug: bool = False):
+        self.metrics = metrics
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self.history: deque[tuple[float, float]] = deque(maxlen=history)
+        self.stalls: deque[Stall] = deque(maxlen=50)
+        self.lag = 0.0
+
+        self.loop: asyncio.AbstractEventLoop = None
+        self.loop_thread_id: int = None
+        self.last_beat = time.monotonic()
+        self.task: asyncio.Task = None
+        self.thread: threading.Thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        if self.debug:
+            self.loop.set_debug(True)
+            self.loop.slow_callback_duration = self.threshold
+
+        self.last_beat = time.monotonic()
+        self.task = self.loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(
+            target=self.watch, name="toof-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        """Sleeps for the interval and records how late it woke up."""
+
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, self.loop.time() - start - self.interval)
+            self.last_beat = time.monotonic()
+            self.history.append((time.time(), self.lag))
+            self.metrics.observe("loop", "lag", self.lag)
+
+    def watch(self):
+        """Runs in its own thread. Captures the loop thread's stack once
+        per stall, while the stall is still happening.
+        """
+
+        captured_beat = None
+        while not self.stopped.wait(self.threshold / 2):
+            beat = self.last_beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue > self.threshold and beat != captured_beat:
+                captured_beat = beat
+                self.capture(overdue)
+
+    def capture(self, lag: float):
+        """Logs and keeps the loop thread's current stack."""
+
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+
+        task = asyncio.current_task(self.loop)
+        stall = Stall(
+            time=time.time(),
+            lag=lag,
+            task=task.get_name() if task else "(no task)",
+            stack="".join(traceback.format_stack(frame)))
+        self.stalls.append(stall)
+        self.metrics.count("loop", "stalls")
+        log.warning(
+            "Event loop blocked for over %.2fs in %s:\n%s",
+            lag, stall.task, stall.stack)
+
+    def summary(self, seconds: float = 300) -> dict[str, float]:
+        """Returns the max and average lag over the last `seconds`."""
+
+        since = time.time() - seconds
+        lags = [lag for at, lag in self.history if at >= since]
+        return {
+            "current": self.lag,
+            "max": max(lags, default=0.0),
+            "average": sum(lags) / len(lags) if lags else 0.0,
+            "samples": len(lags)}
@@ -1,9 +1,10 @@
 """Gives the given user all the ToofPics."""
 
+from datetime import datetime
 import sqlite3
 import sys
 
-from toof.cogs.pics import ToofPic, ToofPics
+from toof.pics import Ownership, ToofPic, ToofPics
 
 
 if __name__ == "__main__":
@@ -23,8 +24,21 @@ if __name__ == "__main__":
     ])
     cursor.close()
 
+    row = conn.execute(
+        "SELECT bits FROM owned_pics WHERE user_id = ?", (user_id,)).fetchone()
+    ownership = Ownership.from_bytes(row[0] if row else None)
+
     for pic in all_pics:
         if pic not in user_pics and pic.rarity.name == "rare":
-            conn.execute(f"INSERT INTO pics VALUES ({user_id}, '{pic.id}', '{pic.link}')")
+            pic.dt = datetime.now()
+            conn.execute(
+                "INSERT INTO pics VALUES (?, ?, ?, ?, ?)",
+                (user_id, pic.id, pic.name, pic.link, pic.date))
+            ownership.add(pic.id)
+    # Keeps the user's bitset in step with their pics rows, in the same
+    # transaction. The bot has to be restarted to drop its cached copy.
+    conn.execute(
+        "INSERT OR REPLACE INTO owned_pics VALUES (?, ?)",
+        (user_id, ownership.to_bytes()))
     conn.commit()
     conn.close()